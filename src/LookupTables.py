@@ -0,0 +1,185 @@
+import numpy as np
+import os
+import hashlib
+from RayGeometry import *
+
+
+class LookupTableCache:
+	"""
+	Keeps precomputed render tables (column maps etc.) in memory and, if a cache directory is set,
+	on disk. Tables only depend on the calibration and render settings, never on the pixels, so
+	for video they are built once and reused for every frame.
+	"""
+	def __init__(self, cache_dir=None):
+		self.tables = {}
+		self.cache_dir = None
+		self.setCacheDirectory(cache_dir)
+
+	def __getstate__(self):
+		# Copies start with an empty memory tier, the disk tier is shared
+		state = self.__dict__.copy()
+		state['tables'] = {}
+		return state
+
+	def setCacheDirectory(self, cache_dir):
+		self.cache_dir = cache_dir
+		if cache_dir is not None and not os.path.isdir(cache_dir):
+			os.makedirs(cache_dir)
+
+	def getTablePath(self, name, key):
+		key_hash = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+		return os.path.join(self.cache_dir, name + '_' + key_hash[:20] + '.npy')
+
+	def getTable(self, name, key, builder, persistent=True):
+		"""
+		Returns the table stored under (name, key). If it is not cached yet it is created by calling
+		builder() and stored. Tables are only written to disk if a cache directory is set, the key
+		is persistent and the key does not contain None.
+		"""
+		full_key = (name,) + tuple(key)
+		if full_key in self.tables:
+			return self.tables[full_key]
+
+		on_disk = persistent and self.cache_dir is not None and None not in key
+		table = None
+		if on_disk:
+			path = self.getTablePath(name, key)
+			if os.path.isfile(path):
+				table = np.load(path)
+		if table is None:
+			table = builder()
+			if on_disk:
+				self.saveTable(path, table)
+
+		self.tables[full_key] = table
+		return table
+
+	def saveTable(self, path, table):
+		# Written under a temporary name first, so other processes never read a partial file
+		temp_path = path + '.' + str(os.getpid()) + '.tmp'
+		with open(temp_path, 'wb') as stream:
+			np.save(stream, table)
+		os.replace(temp_path, path)
+
+	def clear(self):
+		# Only the memory tier, tables on disk are keyed by the camera state and stay valid
+		self.tables = {}
+
+# End class LookupTableCache
+
+
+def buildColumnLUT(camera, viewing_circle_centre, ipd, eye, pan_width):
+	"""
+	For every column of the camera image, find the column of the ODS panaroma it maps to.
+	Returns an int32 array with one panaroma column index per source column.
+	"""
+	image_width = int(camera.resolution[0])
+	global_rays = camera.getColumnRays()
+	xn_rays = mapPointToODSColumnArray(global_rays[:, [0, 2]], viewing_circle_centre, ipd, eye)
+	lut = unnormalizeX(xn_rays, pan_width).astype('int32')
+	# xn can be exactly 1.0 which would index one past the last column
+	return np.clip(lut, 0, pan_width-1)
+
+
+def buildInverseColumnMap(cameras, viewing_circle_centre, ipd, eye, pan_width):
+	"""
+	Output driven column map. For every column of the ODS panaroma, finds the camera that feeds it
+	and the (sub pixel) source column in that camera. When several cameras see a panaroma column,
+	the camera that sees it closest to its principal point is used.
+	Returns a (2, pan_width) float32 array: row 0 is the camera index (-1 if no camera sees the
+	column), row 1 the source column.
+	"""
+	# Panaroma column centres
+	targets = np.arange(pan_width, dtype='float64') + 0.5
+	best_score = np.full(pan_width, np.inf)
+	column_map = np.full((2, pan_width), -1, dtype='float32')
+
+	for i in range(len(cameras)):
+		camera = cameras[i]
+		image_width = int(camera.resolution[0])
+		cols = np.arange(image_width, dtype='float64')
+		rays = camera.getColumnRays()
+		theta = mapPointToODSAngleArray(rays[:, [0, 2]], viewing_circle_centre, ipd, eye)
+		x = unnormalizeX(np.mod(thetaToNormalizedX(theta), 1.0), pan_width)
+		# Continuous panaroma position of every column, without the jump at the 0/360 seam
+		x = np.unwrap(x*2*np.pi/pan_width)*pan_width/(2*np.pi)
+		# np.interp needs increasing sample positions
+		if x[-1] < x[0]:
+			x = x[::-1]
+			cols = cols[::-1]
+		if np.any(np.diff(x) <= 0):
+			raise RuntimeError('Camera columns do not map monotonically onto the panaroma')
+
+		# Camera ranges can cross the 0/360 seam, so also look one panaroma width to either side
+		for shift in [-pan_width, 0, pan_width]:
+			shifted = targets + shift
+			inside = (shifted >= x[0]) & (shifted <= x[-1])
+			src_cols = np.interp(shifted[inside], x, cols)
+			# Prefer the camera that sees the column closest to its principal point
+			score = np.abs(src_cols - camera.intrinsics[0][2])/image_width
+			better = score < best_score[inside]
+			inside_cols = np.nonzero(inside)[0][better]
+			best_score[inside_cols] = score[better]
+			column_map[0, inside_cols] = i
+			column_map[1, inside_cols] = src_cols[better]
+
+	return column_map
+
+
+def buildRowMap(camera, out_height):
+	"""
+	Source row for every panaroma row. Rows are scaled linearly so the panaroma height can differ
+	from the camera resolution.
+	"""
+	image_height = int(camera.resolution[1])
+	rows = np.arange(out_height, dtype='float32')
+	return (rows + 0.5)*(float(image_height)/out_height) - 0.5
+
+
+def buildRowLUT(camera, viewing_circle_centre, viewing_circle_height, ipd, out_height):
+	"""
+	Equirectangular panaroma row for every pixel of the camera image, from the elevation of the
+	pixel's ray. Returns an int32 array with the shape of the image.
+	"""
+	global_rays = camera.getRayBundle()
+	phi = mapPointToODSElevationArray(global_rays, viewing_circle_centre, ipd, viewing_circle_height)
+	lut = unnormalizeY(phiToNormalizedY(phi), out_height).astype('int32')
+	return np.clip(lut, 0, out_height-1)
+
+
+def buildInverseRowTable(camera, viewing_circle_centre, viewing_circle_height, ipd, out_height, columns=None,
+	block_width=64):
+	"""
+	Inverse of buildRowLUT. For every equirectangular panaroma row and every column of the camera
+	image (or only the given image columns), finds the (sub pixel) image row with the elevation of
+	the panaroma row. Returns an (out_height, num_columns) float32 array, -1 where the column does
+	not see the row. Columns are processed block_width at a time, which bounds the float64
+	temporaries to (out_height, block_width).
+	"""
+	image_height = int(camera.resolution[1])
+	image_width = int(camera.resolution[0])
+	if columns is None:
+		columns = np.arange(image_width)
+	global_rays = camera.getRayBundle()
+	# Elevation decreases down every image column, so -phi increases
+	elevation = -mapPointToODSElevationArray(global_rays[:, columns], viewing_circle_centre, ipd, viewing_circle_height)
+	if np.any(np.diff(elevation, axis=0) <= 0):
+		raise RuntimeError('Camera rows do not map monotonically onto the panaroma')
+
+	out_rows = np.arange(out_height, dtype='float64') + 0.5
+	out_elevation = -normalizedYToPhi(out_rows/out_height)
+	table = np.empty((out_height, len(columns)), dtype='float32')
+	for block_start in range(0, len(columns), block_width):
+		block = elevation[:, block_start:block_start + block_width]
+		# Offset every column by more than the range of elevations, so all columns of the block can
+		# be inverted with a single np.interp over the concatenated columns
+		offsets = 2*np.pi*np.arange(block.shape[1])
+		samples = (block + offsets[np.newaxis, :]).T.ravel()
+		rows = np.tile(np.arange(image_height, dtype='float64'), block.shape[1])
+		targets = out_elevation[:, np.newaxis] + offsets[np.newaxis, :]
+		block_table = np.interp(targets.ravel(), samples, rows).reshape(out_height, block.shape[1])
+
+		inside = (targets >= samples[0::image_height]) & (targets <= samples[image_height-1::image_height])
+		block_table[~inside] = -1
+		table[:, block_start:block_start + block.shape[1]] = block_table
+	return table
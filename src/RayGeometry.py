@@ -19,7 +19,8 @@ def thetaToNormalizedX(theta):
 	return (theta + np.pi)/(2*np.pi)
 	
 def phiToNormalizedY(phi):
-	return ((np.pi/2) + phi)/np.pi
+	# Inverse of normalizedYToPhi, the top row of the panaroma is phi = pi/2
+	return ((np.pi/2) - phi)/np.pi
 
 def thetaPhiToNormalizedXY(theta, phi):
 	"""
@@ -95,27 +96,41 @@ def radians2Degrees360(angle_rad):
 	"""
 	Convert an angle in radians to degrees ( 0 to 360)
 	"""
-	if angle_rad > 0:
-		angle = angle_rad
-	else:
-		angle = 2*np.pi - np.abs(angle_rad)
-	return radians2Degrees(angle)
+	return radians2Degrees360Array(angle_rad)[()]
 
 def degrees3602Radians(degree):
 	"""
 	Converts degrees in 360 to radians
 	"""
-	rad = degree2Radians(degree)
-	if rad >= np.pi:
-		rad = -(2*np.pi - rad)
-	return rad
+	return degrees3602RadiansArray(degree)[()]
+
+def radians2Degrees360Array(angles_rad):
+	"""
+	Array version of radians2Degrees360. The wrap is handled with a mask.
+	"""
+	angles_rad = np.asarray(angles_rad)
+	angles = np.where(angles_rad > 0, angles_rad, 2*np.pi - np.abs(angles_rad))
+	return radians2Degrees(angles)
+
+def degrees3602RadiansArray(degrees):
+	"""
+	Array version of degrees3602Radians. The wrap is handled with a mask.
+	"""
+	rad = degree2Radians(np.asarray(degrees))
+	return np.where(rad >= np.pi, rad - 2*np.pi, rad)
 
 def getAngle(centre, cam_pos, ipd):
 	"""
 	This function returns the angle between the centre of the viewing circle and the 
 	vertical that drops from the camera onto the x-axis or the horizontal axis.
 	"""
-	hor = np.linalg.norm(centre-cam_pos)
+	return getAngleArray(centre, cam_pos, ipd)[()]
+
+def getAngleArray(centre, cam_positions, ipd):
+	"""
+	Array version of getAngle for (N, 2) camera positions.
+	"""
+	hor = np.linalg.norm(np.asarray(centre) - np.asarray(cam_positions), axis=-1)
 	ver = ipd/2
 	return np.arcsin(ver/hor)
 
@@ -186,44 +201,75 @@ def xzToTheta(xz, origin):
 	"""
 	Find the angle in radians for some point in space.
 	"""
-	vec = xz-origin
-	return np.arctan2(vec[1], vec[0])
+	return xzToThetaArray(xz, origin)[()]
 
 
 def mapPointToODSAngle(point, origin, ipd, eye=1):
-	dist = np.linalg.norm(np.asarray(point)-np.asarray(origin))
+	return mapPointToODSAngleArray(point, origin, ipd, eye)[()]
+
+
+def xzToThetaArray(xz, origin):
+	"""
+	Array version of xzToTheta for (N, 2) points.
+	"""
+	vec = np.asarray(xz) - np.asarray(origin)
+	return np.arctan2(vec[..., 1], vec[..., 0])
+
+
+def mapPointToODSAngleArray(points, origin, ipd, eye=1):
+	"""
+	Array version of mapPointToODSAngle for (N, 2) points in the xz plane.
+	"""
+	points = np.asarray(points)
+	dist = np.linalg.norm(points - np.asarray(origin), axis=-1)
 	r = ipd/2
 	theta = np.arccos(r/dist)
-	angle_to_x = xzToTheta(np.asarray(point), np.asarray(origin))
-	# print('interior angle: ', radians2Degrees360(theta))
-	# print('additive angle: ', radians2Degrees360(angle_to_x))
-	theta_final = 0
+	angle_to_x = xzToThetaArray(points, origin)
 	if eye==1:
-		theta_final = np.mod(angle_to_x + theta - np.pi, 2*np.pi)
-	else:
-		theta_final = angle_to_x + theta
+		return np.mod(angle_to_x + theta - np.pi, 2*np.pi)
+	return angle_to_x + theta
+
+
+def mapPointToODSElevationArray(points, origin, ipd, height=0):
+	"""
+	Elevation (phi) of (N, 3) points as seen from their tangent point on the viewing circle. The
+	viewing circle lies in the xz plane at y = height. y points down, as in the camera frames, and
+	phi is positive above the viewing circle. The elevation is the same for both eyes.
+	"""
+	points = np.asarray(points)
+	dist = np.linalg.norm(points[..., [0, 2]] - np.asarray(origin), axis=-1)
+	r = ipd/2
+	# Horizontal distance between the tangent point and the point
+	tangent_dist = np.sqrt(np.maximum(dist**2 - r**2, 0))
+	return np.arctan2(height - points[..., 1], tangent_dist)
 
-	return theta_final
 
 def mapPointToODSColumn(point, origin, ipd, eye=1):
-	global_theta = mapPointToODSAngle(point, origin, ipd, eye)
-	# print(radians2Degrees360(global_theta))
+	return mapPointToODSColumnArray(point, origin, ipd, eye)[()]
+
+
+def mapPointToODSColumnArray(points, origin, ipd, eye=1):
+	"""
+	Array version of mapPointToODSColumn for (N, 2) points in the xz plane.
+	"""
+	global_theta = mapPointToODSAngleArray(points, origin, ipd, eye)
 	xn = thetaToNormalizedX(global_theta)
-	# needs handling of discontinuity across 0 and 360 degrees.
-	if xn > 1:
-		xn = xn-1
-	return xn
+	# discontinuity across 0 and 360 degrees.
+	return np.where(xn > 1, xn-1, xn)
 
 
 def get2DPointOnODSVC(point, origin, ipd, eye=1):
-	t_final = mapPointToODSAngle(point, origin, ipd, eye)
-	# print(radians2Degrees(t_final))
-	x = (ipd/2)*np.cos(t_final)
-	y = (ipd/2)*np.sin(t_final)
-	x = x + origin[0]
-	y = y + origin[1]
-	point = np.asarray((x, y), dtype='float32')
-	return point
+	return get2DPointOnODSVCArray(point, origin, ipd, eye)
+
+
+def get2DPointOnODSVCArray(points, origin, ipd, eye=1):
+	"""
+	Array version of get2DPointOnODSVC. Returns the tangent points on the viewing circle as (N, 2).
+	"""
+	t_final = mapPointToODSAngleArray(points, origin, ipd, eye)
+	x = (ipd/2)*np.cos(t_final) + origin[0]
+	y = (ipd/2)*np.sin(t_final) + origin[1]
+	return np.stack((x, y), axis=-1).astype('float32')
 
 
 def fitCircleTo3Points(point1, point2, point3):
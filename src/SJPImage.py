@@ -4,6 +4,7 @@ import imutils
 import os 
 import os.path as op
 import yaml
+from concurrent.futures import ThreadPoolExecutor
 from Stitcher import *
 from ExposureCorrect import *
 
@@ -39,10 +40,16 @@ class SJPImage:
 		self.H_right = None
 		self.Matches_left = None
 		self.Matches_right = None
+		self.keypoints = None
+		# Keypoints and descriptors per feature type, see getFeatures
+		self.features = {}
+		self.feature_indexes = {}
+		self.features_image = None
+		# Feature backend used for keypoints and matching, see getStitcher
+		self.stitcher = None
 
 	def initializeImage(self, left_image=None, right_image=None):
-		stitcher = Stitcher()
-		self.setKeypoints(stitcher.getKeyPoints(self.cv_image))
+		self.setKeypoints(self.getFeatures()[0])
 		if left_image is not None:
 			self.left_image = left_image
 		if right_image is not None:
@@ -67,23 +74,26 @@ class SJPImage:
 		if (self.keypoints is None):
 			raise RuntimeError('Keypoints must be set for this image before calling this function')
 
-		stitcher = Stitcher()
+		stitcher = self.getStitcher()
+		# Match indices point into the keypoints of the stitcher's features, which can differ from the
+		# keypoints stored by initializeImage if the stitcher was changed since
+		keypoints = self.getFeatures(stitcher)[0]
 		valLeft = 0
 		valRight = 0
 		if (leftImage is not None):
-			(matches, H, status) = stitcher.getKeyPointMatches(self.getImage(), leftImage.getImage())
+			(matches, H, status) = stitcher.getImageMatches(self, leftImage)
 			# Calculate region of overlap after keypoint matching
 			ov_proc = ImageOverlapProcessor(self.getImageDim(), direction='right')
-			ov_proc.calculateRegionOfOverlap(self.getKeypoints(), matches, status)
+			ov_proc.calculateRegionOfOverlap(keypoints, matches, status)
 			valLeft = ov_proc.getAverageOverlapIntensity(self.getImage())
 			self.H_left = H
 			self.Matches_right = matches
 		
 		if (rightImage is not None):
-			(matches, H, status) = stitcher.getKeyPointMatches(rightImage.getImage(), self.getImage())
+			(matches, H, status) = stitcher.getImageMatches(rightImage, self)
 			# Calculate region of overlap after keypoint matching
 			ov_proc = ImageOverlapProcessor(self.getImageDim(), direction='left')
-			ov_proc.calculateRegionOfOverlap(self.getKeypoints(), matches, status)
+			ov_proc.calculateRegionOfOverlap(keypoints, matches, status)
 			valRight = ov_proc.getAverageOverlapIntensity(self.getImage())
 			self.H_right = H
 			self.Matches_right = matches
@@ -97,6 +107,8 @@ class SJPImage:
 		for i in range(self.cols):
 			gain = self.__calculateWeightedGain(i)
 			self.cv_image[:, i, :] = self.cv_image[:, i, :] * gain
+		# Pixels changed in place, so features have to be detected again
+		self.invalidateFeatures()
 
 	def __calculateWeightedGain(self, col_index):
 		mid_point = float(self.cols/2)
@@ -129,6 +141,55 @@ class SJPImage:
 	def setCameraID(self, cid):
 		self.cameraID = cid
 
+	def getFeatures(self, stitcher=None):
+		"""
+		(keypoints, descriptors) of the image for the feature type of stitcher. Detected once and reused
+		by every match until cv_image is replaced or invalidateFeatures is called.
+		"""
+		if stitcher is None:
+			stitcher = self.getStitcher()
+		if self.features_image is not self.cv_image:
+			self.invalidateFeatures()
+			self.features_image = self.cv_image
+		key = stitcher.getFeatureKey()
+		if key not in self.features:
+			self.features[key] = stitcher.detectAndDescribe(self.cv_image)
+		return self.features[key]
+
+	def getFeatureIndex(self, stitcher=None):
+		"""
+		Matcher trained on the descriptors of this image (e.g. a FLANN index), built once and reused
+		whenever another image is matched against this one.
+		"""
+		if stitcher is None:
+			stitcher = self.getStitcher()
+		(keypoints, descriptors) = self.getFeatures(stitcher)
+		key = stitcher.getMatcherKey()
+		if key not in self.feature_indexes:
+			self.feature_indexes[key] = stitcher.createMatcherIndex(descriptors)
+		return self.feature_indexes[key]
+
+	def invalidateFeatures(self):
+		# Needed after cv_image is modified in place
+		self.features = {}
+		self.feature_indexes = {}
+		self.features_image = None
+
+	def __getstate__(self):
+		# Matcher indexes are OpenCV objects and can not be pickled, copies rebuild them on demand
+		state = self.__dict__.copy()
+		state['feature_indexes'] = {}
+		return state
+
+	def getStitcher(self):
+		# Default SURF stitcher, created once so its detector is reused
+		if self.stitcher is None:
+			self.stitcher = Stitcher()
+		return self.stitcher
+
+	def setStitcher(self, stitcher):
+		self.stitcher = stitcher
+
 	def setKeypoints(self, keypoints):
 		self.keypoints = keypoints
 
@@ -190,32 +251,105 @@ class SJPImage:
 # End class SJPImage
 
 
+class PairMatch:
+	"""
+	Matching result of two neighbouring images of a ring, see SJPImageCollection.matchRing.
+	H maps points of the right image to the left image, matches are (trainIdx, queryIdx) with the
+	left image as train image and inlier_mask flags the matches that fit H. overlap_left and
+	overlap_right are the [start, end] columns of the overlap in either image. H, matches and the
+	overlaps are None if the images could not be matched.
+	"""
+	def __init__(self, left_index, right_index, H=None, matches=None, inlier_mask=None, overlap_left=None,
+		overlap_right=None):
+		self.left_index = left_index
+		self.right_index = right_index
+		self.H = H
+		self.matches = matches
+		self.inlier_mask = inlier_mask
+		self.overlap_left = overlap_left
+		self.overlap_right = overlap_right
+
+	def isMatched(self):
+		return self.H is not None
+
+	def getNumberOfInliers(self):
+		if self.inlier_mask is None:
+			return 0
+		return int(np.count_nonzero(self.inlier_mask))
+
+# End class PairMatch
+
+
+def matchImagePair(stitcher, left_image, right_image, left_index, right_index, ratio=0.7, reprojThresh=5.0):
+	"""
+	PairMatch of two neighbouring SJPImages, with the features cached on the images.
+	"""
+	M = stitcher.getImageMatches(right_image, left_image, ratio, reprojThresh)
+	if M is None:
+		return PairMatch(left_index, right_index)
+
+	(matches, H, status) = M
+	inlier_mask = np.asarray(status).ravel() == 1
+	overlap_left = None
+	overlap_right = None
+	if np.any(inlier_mask):
+		# Same as updateOverlappingRegions: the left image sees its right neighbour and vice versa
+		ov_proc = ImageOverlapProcessor(left_image.getImageDim(), direction='left')
+		ov_proc.calculateRegionOfOverlap(left_image.getFeatures(stitcher)[0], matches, status)
+		overlap_left = ov_proc.getRegionOfOverlap()
+		ov_proc = ImageOverlapProcessor(right_image.getImageDim(), direction='right')
+		ov_proc.calculateRegionOfOverlap(right_image.getFeatures(stitcher)[0], matches, status)
+		overlap_right = ov_proc.getRegionOfOverlap()
+	return PairMatch(left_index, right_index, H, matches, inlier_mask, overlap_left, overlap_right)
+
+
 class SJPImageCollection:
 	def __init__(self, sjp_image_list = None):
 		self.sjp_image_list = []
 		self.frameID = -1
 		self.num_images = 0
+		self.stitcher = None
 
 	
 	def addImageToCollection(self, sjp_image):
+		if self.stitcher is not None:
+			sjp_image.setStitcher(self.stitcher)
 		self.sjp_image_list.append(sjp_image)
 		self.num_images = self.num_images + 1
 
+	def setStitcher(self, stitcher):
+		"""
+		Feature backend shared by all images of the collection, e.g. Stitcher('orb').
+		"""
+		self.stitcher = stitcher
+		for sjp_image in self.sjp_image_list:
+			sjp_image.setStitcher(stitcher)
 
-	def loadImagesFromYAML(self, file_name, cam_name):
+
+	def loadImagesFromYAML(self, file_name, cam_name, initialize=True):
 		with open(file_name, 'r') as stream:
 			try:
-				calib_data = yaml.load(stream)
+				calib_data = yaml.safe_load(stream)
 			except Exception as e:
 				raise RuntimeError('Something bad happened when loading the .yaml file')
 
 		image_names = calib_data[cam_name]['images']
 		for image in image_names:
 			print('reading image: ', image)
+		self.loadImagesFromFiles(image_names, cam_name, initialize)
+
+	def loadImagesFromFiles(self, image_names, frame_id, initialize=True):
+		"""
+		Adds one image per camera, in camera order. Rendering does not need keypoints, so
+		initialize=False skips the keypoint detection done by SJPImage.initializeImage.
+		"""
+		for image in image_names:
 			im_new = SJPImage(file_name=image, resize=False)
-			im_new.initializeImage()
-			im_new.setFrameID(cam_name)
+			im_new.setFrameID(frame_id)
+			# Added first, so keypoints are detected with the stitcher of the collection
 			self.addImageToCollection(im_new)
+			if initialize:
+				im_new.initializeImage()
 
 
 	def setFrameID(self, frameID):
@@ -224,6 +358,35 @@ class SJPImageCollection:
 	def getNumberOfImages(self):
 		return self.num_images
 
+	def matchRing(self, neighbour_order=None, num_threads=None, ratio=0.7, reprojThresh=5.0, closed=True):
+		"""
+		Matches every image with its right neighbour, with the images in neighbour_order (default:
+		collection order) around the ring. With closed=True the last image is also matched with the
+		first. Returns one PairMatch per neighbouring pair, in ring order.
+		The work runs on num_threads threads (default: one per pair), OpenCV releases the GIL while
+		detecting and matching. Features and indexes are first computed once per image, then the pairs
+		are matched.
+		"""
+		if neighbour_order is None:
+			neighbour_order = list(range(self.num_images))
+		if len(neighbour_order) < 2:
+			raise RuntimeError('A ring needs at least two images')
+		pairs = [(neighbour_order[k], neighbour_order[k+1]) for k in range(len(neighbour_order)-1)]
+		if closed and len(neighbour_order) > 2:
+			pairs.append((neighbour_order[-1], neighbour_order[0]))
+		if num_threads is None:
+			num_threads = len(pairs)
+
+		stitcher = self.stitcher
+		if stitcher is None:
+			stitcher = Stitcher()
+		# Every image is handled by one task with its own detector, so no cache or detector is shared
+		images = sorted(set(neighbour_order))
+		with ThreadPoolExecutor(max_workers=num_threads) as executor:
+			list(executor.map(lambda i: self.sjp_image_list[i].getFeatureIndex(stitcher.copy()), images))
+			return list(executor.map(lambda pair: matchImagePair(stitcher, self.sjp_image_list[pair[0]],
+				self.sjp_image_list[pair[1]], pair[0], pair[1], ratio, reprojThresh), pairs))
+
 	def __getitem__(self, key):
 		return self.sjp_image_list[key]
 
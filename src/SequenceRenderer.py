@@ -0,0 +1,137 @@
+import numpy as np
+import os
+import glob
+import re
+import time
+import yaml
+from concurrent.futures import ThreadPoolExecutor
+from SJPImage import *
+
+
+def naturalSortKey(name):
+	"""
+	Sort key that orders 'frame2' before 'frame10'.
+	"""
+	return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+def getFramesFromYAML(file_name):
+	"""
+	Returns [(frame_name, [image file per camera]), ...] for every frame listed in a data.yaml file,
+	ordered by frame number.
+	"""
+	with open(file_name, 'r') as stream:
+		try:
+			data = yaml.safe_load(stream)
+		except Exception as e:
+			raise RuntimeError('Something bad happened when loading the .yaml file')
+
+	frame_names = sorted([name for name in data if 'images' in data[name]], key=naturalSortKey)
+	return [(name, data[name]['images']) for name in frame_names]
+
+
+def getFramesFromDirectory(record_directory, num_cameras, pattern='*.png'):
+	"""
+	Returns [(frame_name, [image file per camera]), ...] for a recording laid out as
+	record_directory/camN/<frame>.png. Frames are matched by their position in the sorted file list
+	of each camera.
+	"""
+	camera_files = []
+	for i in range(num_cameras):
+		files = glob.glob(os.path.join(record_directory, 'cam' + str(i), pattern))
+		camera_files.append(sorted(files, key=naturalSortKey))
+
+	num_frames = min([len(files) for files in camera_files])
+	if num_frames == 0:
+		raise RuntimeError('No frames found in ', record_directory)
+	if any([len(files) != num_frames for files in camera_files]):
+		print('Cameras have different numbers of frames, using the first ', num_frames)
+
+	frames = []
+	for f in range(num_frames):
+		frame_name = os.path.splitext(os.path.basename(camera_files[0][f]))[0]
+		frames.append((frame_name, [files[f] for files in camera_files]))
+	return frames
+
+
+def loadFrame(frame):
+	frame_name, image_names = frame
+	image_collection = SJPImageCollection()
+	image_collection.loadImagesFromFiles(image_names, frame_name, initialize=False)
+	return image_collection
+
+
+class SequenceRenderer:
+	"""
+	Renders stereo panaromas for a sequence of synchronized frames. The camera setup and the lookup
+	tables of the ODS renderer are computed for the first frame and reused for the others, and the
+	images of the next frame are read on a background thread while the current frame renders.
+	With warm_start_flow, the optical flow of every pair starts from its flow in the previous frame,
+	see RendererODS.setTemporalFlow.
+	"""
+	def __init__(self, renderer, frames):
+		self.renderer = renderer
+		self.frames = frames
+		self.frames_rendered = 0
+		self.render_time = 0.0
+
+	def getNumberOfFrames(self):
+		return len(self.frames)
+
+	def renderFrame(self, ipd, output_image_dim, origin, mode, vi_type, num_workers, blend):
+		if mode == 'interpolation':
+			return self.renderer.renderStereo360(ipd, output_image_dim, origin=origin, vi_type=vi_type,
+				num_workers=num_workers, blend=blend)
+		elif mode == 'remap':
+			left = self.renderer.render360InverseMapping(ipd, output_image_dim, eye=-1, origin=origin)
+			right = self.renderer.render360InverseMapping(ipd, output_image_dim, eye=1, origin=origin)
+			return left, right
+		else:
+			raise RuntimeError('Unknown render mode : ', mode)
+
+	def render(self, ipd, output_image_dim, origin=[0, 0, 0], mode='interpolation', vi_type='cwise',
+		num_workers=1, blend='average', warm_start_flow=False):
+		"""
+		Generator that yields (frame_name, left, right) for every frame, in frame order.
+		mode='interpolation' renders with view interpolation (RendererODS.renderStereo360),
+		mode='remap' without (RendererODS.render360InverseMapping).
+		"""
+		self.frames_rendered = 0
+		self.render_time = 0.0
+		if len(self.frames) == 0:
+			return
+
+		# Temporal flow state only makes sense for this sequence, so it is set up here and removed again
+		previous_temporal_flow = self.renderer.temporal_flow
+		self.renderer.setTemporalFlow(warm_start_flow)
+		try:
+			for result in self.renderFrames(ipd, output_image_dim, origin, mode, vi_type, num_workers, blend):
+				yield result
+		finally:
+			self.renderer.temporal_flow = previous_temporal_flow
+
+	def renderFrames(self, ipd, output_image_dim, origin, mode, vi_type, num_workers, blend):
+		with ThreadPoolExecutor(max_workers=1) as loader:
+			next_images = loader.submit(loadFrame, self.frames[0])
+			for f in range(len(self.frames)):
+				start = time.time()
+				image_collection = next_images.result()
+				# Prefetch the next frame while this one renders
+				if f+1 < len(self.frames):
+					next_images = loader.submit(loadFrame, self.frames[f+1])
+
+				self.renderer.setImageList(image_collection)
+				left, right = self.renderFrame(ipd, output_image_dim, origin, mode, vi_type, num_workers, blend)
+				self.render_time = self.render_time + (time.time() - start)
+				self.frames_rendered = self.frames_rendered + 1
+				yield self.frames[f][0], left, right
+
+	def getFramesPerSecond(self):
+		"""
+		Frames per second over the frames rendered so far, including waiting for images.
+		"""
+		if self.render_time == 0:
+			return 0.0
+		return self.frames_rendered/self.render_time
+
+# End class SequenceRenderer
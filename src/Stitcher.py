@@ -3,11 +3,60 @@ import imutils
 import cv2
 
 
+def createSIFT():
+	# SIFT is in the main modules since OpenCV 4.4, in the contrib modules before
+	if hasattr(cv2, 'SIFT_create'):
+		return cv2.SIFT_create()
+	return cv2.xfeatures2d.SIFT_create()
+
+# Feature backends by name: (detector constructor, binary descriptors). SURF needs OpenCV built with
+# the non-free contrib modules. Binary descriptors are matched with the Hamming distance.
+feature_backends = {
+	'surf': (lambda: cv2.xfeatures2d.SURF_create(), False),
+	'sift': (createSIFT, False),
+	'orb': (lambda: cv2.ORB_create(nfeatures=2000), True),
+	'akaze': (lambda: cv2.AKAZE_create(), True)}
+
+# Robust homography estimators by name. The USAC methods need OpenCV 4.5 or newer.
+homography_estimators = {'ransac': 'RANSAC', 'usac_default': 'USAC_DEFAULT', 'usac_fast': 'USAC_FAST',
+	'usac_accurate': 'USAC_ACCURATE', 'usac_magsac': 'USAC_MAGSAC'}
+
+# FLANN index types
+FLANN_INDEX_KDTREE = 1
+FLANN_INDEX_LSH = 6
+
+
 class Stitcher:
-	def __init__(self):
-		# Do nothing
+	def __init__(self, feature_type='surf', matcher_type='bruteforce', estimator='ransac'):
+		"""
+		matcher_type is 'bruteforce' or 'flann' (approximate, KD-trees for float descriptors and LSH for
+		binary ones). estimator is a key of homography_estimators.
+		"""
 		self.name = 'Stitcher'
-
+		if feature_type not in feature_backends:
+			raise RuntimeError('Unknown feature type : ', feature_type)
+		if matcher_type not in ['bruteforce', 'flann']:
+			raise RuntimeError('Unknown matcher type : ', matcher_type)
+		if estimator not in homography_estimators or not hasattr(cv2, homography_estimators[estimator]):
+			raise RuntimeError('Homography estimator is not available : ', estimator)
+		self.feature_type = feature_type
+		self.binary_features = feature_backends[feature_type][1]
+		self.matcher_type = matcher_type
+		self.estimator = estimator
+		self.estimator_method = getattr(cv2, homography_estimators[estimator])
+		# Created on first use and reused for every image
+		self.detector = None
+
+
+	def __getstate__(self):
+		# OpenCV objects can not be pickled, copies in other processes create their own detector
+		state = self.__dict__.copy()
+		state['detector'] = None
+		return state
+
+	def copy(self):
+		# Same settings with its own detector, e.g. for another thread
+		return Stitcher(self.feature_type, self.matcher_type, self.estimator)
 
 	def stitch(self, 
 				image1, 
@@ -45,6 +94,42 @@ class Stitcher:
 
 		return result
 
+	def getImageMatches(self, sjp_image1, sjp_image2, ratio=0.7, reprojThresh=5.0):
+		# Same as getKeyPointMatches for two SJPImages, with the features cached on the images
+		(kp1, feat1) = sjp_image1.getFeatures(self)
+		(kp2, feat2) = sjp_image2.getFeatures(self)
+
+		M = self.matchKeyPoints(kp1, kp2, feat1, feat2, ratio, reprojThresh, sjp_image2.getFeatureIndex(self))
+
+		return M
+
+	def getFeatureKey(self):
+		# Identifies the keypoints and descriptors this stitcher computes, see SJPImage.getFeatures
+		return (self.feature_type,)
+
+	def getMatcherKey(self):
+		# Identifies the descriptor index built by createMatcherIndex
+		return (self.feature_type, self.matcher_type)
+
+	def createMatcherIndex(self, features):
+		"""
+		Matcher trained on the descriptors features of one image, so it can be reused to match every
+		other image against them.
+		"""
+		if self.matcher_type == 'flann':
+			if self.binary_features:
+				index_params = dict(algorithm=FLANN_INDEX_LSH, table_number=6, key_size=12, multi_probe_level=1)
+			else:
+				index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=4)
+			matcher = cv2.FlannBasedMatcher(index_params, dict(checks=32))
+		elif self.binary_features:
+			matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+		else:
+			matcher = cv2.BFMatcher(cv2.NORM_L2)
+		matcher.add([features])
+		matcher.train()
+		return matcher
+
 	def getKeyPointMatches(self, image1, image2, ratio=0.7, reprojThresh=5.0):
 		(kp1, feat1) = self.detectAndDescribe(image1)
 		(kp2, feat2) = self.detectAndDescribe(image2)
@@ -60,32 +145,39 @@ class Stitcher:
 	def detectAndDescribe(self, image):
 		if len(image.shape) ==3:
 			gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+		else:
+			gray = image
 
-		# openCV v3.x compatible code
-		descriptor = cv2.xfeatures2d.SURF_create()
-		(kps, features) = descriptor.detectAndCompute(image, None)
+		if self.detector is None:
+			self.detector = feature_backends[self.feature_type][0]()
+		(kps, features) = self.detector.detectAndCompute(gray, None)
 
 		kps = np.float32([kp.pt for kp in kps])
 
 		return (kps, features)
 
-	def matchKeyPoints(self, kp1, kp2, feat1, feat2, ratio, rThresh):
-		matcher = cv2.DescriptorMatcher_create("BruteForce")
-		rawMatches = matcher.knnMatch(feat1, feat2, 2)
-		matches = []
-
-		for m in rawMatches:
-			# Lowe's ratio test to detect false positives
-			if len(m) == 2 and m[0].distance < m[1].distance * ratio:
-				matches.append((m[0].trainIdx, m[0].queryIdx))
+	def matchKeyPoints(self, kp1, kp2, feat1, feat2, ratio, rThresh, index2=None):
+		"""
+		Matches are returned as an (N, 2) array of (trainIdx, queryIdx). index2 is an optional matcher
+		already trained on feat2, see createMatcherIndex.
+		"""
+		if index2 is None:
+			index2 = self.createMatcherIndex(feat2)
+		# Approximate matchers can return less than two neighbours
+		rawMatches = [m for m in index2.knnMatch(feat1, k=2) if len(m) == 2]
+		distances = np.float32([(m[0].distance, m[1].distance) for m in rawMatches]).reshape(-1, 2)
+		indices = np.int32([(m[0].trainIdx, m[0].queryIdx) for m in rawMatches]).reshape(-1, 2)
+
+		# Lowe's ratio test to detect false positives
+		matches = indices[distances[:, 0] < distances[:, 1] * ratio]
 
 		# print(len(matches), len(kp1), len(kp2))
 		if len(matches) > 4:
-			pts1 = np.float32([kp1[i] for (_, i) in matches])
-			pts2 = np.float32([kp2[i] for (i, _) in matches])
+			pts1 = np.float32(kp1)[matches[:, 1]]
+			pts2 = np.float32(kp2)[matches[:, 0]]
 
 			# compute homography
-			(H, status) = cv2.findHomography(pts1, pts2, cv2.RANSAC, rThresh)
+			(H, status) = cv2.findHomography(pts1, pts2, self.estimator_method, rThresh)
 
 			return (matches, H, status)
 
@@ -144,18 +236,16 @@ class ImageOverlapProcessor:
 
 
 	def __filterKeyPoints(self, keypoints, matches, status):
-		k_filtered = []
-		for ((ti, qi), s) in zip(matches, status):
-			if s==1:
-				if self.direction == 'left':
-					pt = (int(keypoints[ti][0]), int(keypoints[ti][1]))
-				elif self.direction == 'right':
-					pt = (int(keypoints[qi][0]), int(keypoints[qi][1]))
-				else:
-					raise RuntimeError('Unknown direction in calculating image overlap')
-				k_filtered.append(pt)
-
-		return np.asarray(k_filtered)
+		matches = np.asarray(matches).reshape(-1, 2)
+		inliers = np.asarray(status).ravel() == 1
+		if self.direction == 'left':
+			indices = matches[inliers, 0]
+		elif self.direction == 'right':
+			indices = matches[inliers, 1]
+		else:
+			raise RuntimeError('Unknown direction in calculating image overlap')
+
+		return np.asarray(keypoints)[indices].astype('int')
 
 	def getAverageOverlapIntensity(self, image):
 		image_dim = image.shape
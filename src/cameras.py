@@ -1,9 +1,14 @@
 import yaml
 import numpy as np
+import cv2
 import os
+import hashlib
 import matplotlib.pyplot as pyplt
 from RayGeometry import *
 
+# Width of the point grid passed to cv2.remap, which needs both dimensions below SHRT_MAX
+REMAP_BLOCK_WIDTH = 16384
+
 
 class Camera:
     def __init__(self):
@@ -14,7 +19,7 @@ class Camera:
         # Current calibration file does not have absolute parameters
         self.extrinsics_absolute = np.identity(4, dtype='float32')
         self.distortion = np.zeros((4, 1), dtype='float32')
-        self.resolution = np.zeros((2, 1), dtype='int32')
+        self.resolution = np.zeros(2, dtype='int32')
         self.fx = 0
         self.fy = 0
         self.fov_x = 0
@@ -27,6 +32,11 @@ class Camera:
         self.cop_rtheta_right = 0
         self.odsleft_xnorm = 0
         self.odsright_xnorm = 0
+        # Cached global rays for pixel grids, see getRayBundle
+        self.ray_bundles = {}
+        self.ray_bundle_state = None
+        # Use the radtan distortion coefficients when generating rays
+        self.undistort_rays = False
 
     def loadCameraFromYaml(self, yaml_calibration, cam_name):
         self.camera_name = cam_name
@@ -67,10 +77,78 @@ class Camera:
 
     def getRayForPixelInLocalRef(self, x, y):
         self.cameraSanityCheck()
+        if self.undistort_rays:
+            return self.getRaysForPixelsInLocalRef(x, y)
         pix_homo = np.asarray([x, y, 1], dtype='float32')
         ray = np.dot(self.intrinsics_inverse, pix_homo)
         return ray
 
+    def setUndistortRays(self, undistort):
+        self.undistort_rays = undistort
+
+    def getRaysForPixelsInLocalRef(self, cols, rows):
+        """
+        Batched version of getRayForPixelInLocalRef. If undistort_rays is set, the rays go through the
+        undistorted image points, looked up in the precomputed undistortion map.
+        """
+        self.cameraSanityCheck()
+        cols, rows = np.broadcast_arrays(np.asarray(cols, dtype='float64'), np.asarray(rows, dtype='float64'))
+        if not self.undistort_rays:
+            pix_homo = np.stack((cols, rows, np.ones(cols.shape)), axis=-1)
+            return np.dot(pix_homo, np.asarray(self.intrinsics_inverse, dtype='float64').T)
+
+        # Bilinear lookup in the undistortion map for points inside the image
+        shape = cols.shape
+        cols = cols.ravel()
+        rows = rows.ravel()
+        map_xy = self.getUndistortionMap()
+        # cv2.remap needs both dimensions of the lookup below SHRT_MAX, so the points are laid out on
+        # a (num_rows, REMAP_BLOCK_WIDTH) grid, padded at the end
+        num_points = cols.shape[0]
+        num_rows = max(1, -(-num_points // REMAP_BLOCK_WIDTH))
+        block_width = min(num_points, REMAP_BLOCK_WIDTH) if num_points > 0 else 1
+        padding = num_rows*block_width - num_points
+        map_cols = np.pad(cols, (0, padding)).reshape(num_rows, block_width).astype('float32')
+        map_rows = np.pad(rows, (0, padding)).reshape(num_rows, block_width).astype('float32')
+        xy = cv2.remap(map_xy, map_cols, map_rows, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        xy = xy.reshape(-1, 2)[0:num_points].astype('float64')
+        # Points outside the image (e.g. flow correspondences) are undistorted directly
+        outside = (cols < 0) | (rows < 0) | (cols > self.resolution[0]-1) | (rows > self.resolution[1]-1)
+        if np.any(outside):
+            xy[outside] = self.undistortPoints(np.stack((cols[outside], rows[outside]), axis=-1))
+        rays = np.concatenate((xy, np.ones((len(xy), 1))), axis=-1)
+        return rays.reshape(shape + (3,))
+
+    def undistortPoints(self, points):
+        """
+        Normalized (pinhole) image co-ordinates for (N, 2) distorted pixel co-ordinates.
+        """
+        src = np.asarray(points, dtype='float64').reshape(-1, 1, 2)
+        intrinsics = np.asarray(self.intrinsics, dtype='float64')
+        distortion = np.asarray(self.distortion, dtype='float64').ravel()
+        criteria = (cv2.TERM_CRITERIA_COUNT | cv2.TERM_CRITERIA_EPS, 20, 1e-8)
+        if hasattr(cv2, 'undistortPointsIter'):
+            undistorted = cv2.undistortPointsIter(src, intrinsics, distortion, None, None, criteria)
+        else:
+            undistorted = cv2.undistortPoints(src, intrinsics, distortion)
+        return undistorted.reshape(-1, 2)
+
+    def getUndistortionMap(self):
+        """
+        (height, width, 2) float32 map with the normalized undistorted co-ordinates of every pixel.
+        Computed once per camera with a single cv2 call and cached like the ray bundles.
+        """
+        self.checkRayCache()
+        if 'undistortion_map' not in self.ray_bundles:
+            width = int(self.resolution[0])
+            height = int(self.resolution[1])
+            cols, rows = np.meshgrid(np.arange(width), np.arange(height))
+            points = np.stack((cols.ravel(), rows.ravel()), axis=-1)
+            undistortion_map = self.undistortPoints(points).reshape(height, width, 2).astype('float32')
+            undistortion_map.setflags(write=False)
+            self.ray_bundles['undistortion_map'] = undistortion_map
+        return self.ray_bundles['undistortion_map']
+
     def getRayForPixelInGlobalRef(self, col, row):
         self.cameraSanityCheck()
         local_ray = self.getRayForPixelInLocalRef(col, row)
@@ -79,6 +157,69 @@ class Camera:
         global_ray = np.dot(self.extrinsics_absolute, ray_homogeneous)
         return global_ray[0:3]
 
+    def getRaysForPixelsInGlobalRef(self, cols, rows):
+        """
+        Batched version of getRayForPixelInGlobalRef. cols and rows are broadcast against each other
+        and the rays are returned with an extra last axis of size 3.
+        """
+        self.cameraSanityCheck()
+        local_rays = self.getRaysForPixelsInLocalRef(cols, rows)
+        extrinsics = np.asarray(self.extrinsics_absolute, dtype='float64')
+        return np.dot(local_rays, extrinsics[0:3, 0:3].T) + extrinsics[0:3, 3]
+
+    def getRayBundle(self, cols=None, rows=None):
+        """
+        Global rays for the pixel grid spanned by cols and rows (all columns / all rows by default),
+        as a read only (len(rows), len(cols), 3) array. See getColumnRays for the column strip.
+        Bundles are computed with one matrix multiply and cached on the camera. The cache is dropped
+        when the intrinsics, the distortion handling or the absolute extrinsics change.
+        """
+        self.cameraSanityCheck()
+        if cols is None:
+            cols = np.arange(int(self.resolution[0]))
+        if rows is None:
+            rows = np.arange(int(self.resolution[1]))
+        cols = np.asarray(cols, dtype='float64')
+        rows = np.asarray(rows, dtype='float64')
+
+        self.checkRayCache()
+        key = (cols.tobytes(), rows.tobytes())
+        if key not in self.ray_bundles:
+            bundle = self.getRaysForPixelsInGlobalRef(cols[np.newaxis, :], rows[:, np.newaxis])
+            bundle.setflags(write=False)
+            self.ray_bundles[key] = bundle
+        return self.ray_bundles[key]
+
+    def getColumnStripRow(self):
+        """
+        Image row whose rays stand for whole columns when columns are mapped onto the panaroma. Row 0
+        for pinhole rays. Undistorted rays use the principal row, where distortion bends the
+        columns the least.
+        """
+        if self.undistort_rays:
+            return float(self.intrinsics[1][2])
+        return 0.0
+
+    def getColumnRays(self):
+        # Global rays of every image column, sampled at getColumnStripRow
+        return self.getRayBundle(rows=[self.getColumnStripRow()])[0]
+
+    def __getstate__(self):
+        # Cached rays are rebuilt on demand, copies (e.g. in worker processes) start without them
+        state = self.__dict__.copy()
+        state['ray_bundles'] = {}
+        state['ray_bundle_state'] = None
+        return state
+
+    def checkRayCache(self):
+        # Drop cached rays if anything they were computed from has changed
+        state = (self.intrinsics, self.intrinsics_inverse, self.extrinsics_absolute, self.distortion,
+            self.undistort_rays)
+        if self.ray_bundle_state is None or not all(
+                [np.array_equal(a, b) for (a, b) in zip(state, self.ray_bundle_state)]):
+            self.ray_bundles = {}
+            self.ray_bundle_state = tuple([np.array(a, copy=True) for a in state])
+
     def getFieldOfView(self):
         return self.fov_x
 
@@ -141,6 +282,58 @@ class Camera:
 # end class Camera 
 
 
+class RigGeometry:
+    """
+    Read only snapshot of the rig geometry for one IPD and origin, stored as arrays with one entry
+    per camera. Created by CameraCollection.compile, renderers read all per camera geometry from it
+    instead of recomputing it for every render and every camera pair.
+    """
+    def __init__(self, ipd, origin, extrinsics_absolute, camera_positions, viewing_circle_centre,
+                 viewing_circle_radius, cop_angles, cop_columns_left, cop_columns_right,
+                 ods_angles_left, ods_angles_right, ods_positions_left, ods_positions_right):
+        self.ipd = ipd
+        self.origin = origin
+        self.num_cameras = camera_positions.shape[0]
+        self.viewing_circle_radius = viewing_circle_radius
+        # (N, 4, 4) absolute extrinsics and (N, 2) xz positions of the cameras
+        self.extrinsics_absolute = extrinsics_absolute
+        self.camera_positions = camera_positions
+        self.viewing_circle_centre = viewing_circle_centre
+        # The viewing circle lies in the plane of the cameras
+        self.viewing_circle_height = float(np.mean(extrinsics_absolute[:, 1, 3]))
+        # Angle between the camera and its tangent to the viewing circle, and the image columns
+        # (centres of projection) that it maps to for the left and right eye
+        self.cop_angles = cop_angles
+        self.cop_columns_left = cop_columns_left
+        self.cop_columns_right = cop_columns_right
+        # Where the cameras map onto the ODS panaroma, as angles and as normalized columns
+        self.ods_angles_left = ods_angles_left
+        self.ods_angles_right = ods_angles_right
+        self.ods_positions_left = ods_positions_left
+        self.ods_positions_right = ods_positions_right
+        for value in self.__dict__.values():
+            if isinstance(value, np.ndarray):
+                value.setflags(write=False)
+        self.init_complete = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, 'init_complete', False):
+            raise RuntimeError('Rig geometry is read only. Compile the camera collection again instead.')
+        object.__setattr__(self, name, value)
+
+    def getODSAngles(self, eye):
+        if eye == 1:
+            return self.ods_angles_right
+        return self.ods_angles_left
+
+    def getODSPositions(self, eye):
+        if eye == 1:
+            return self.ods_positions_right
+        return self.ods_positions_left
+
+# end class RigGeometry
+
+
 class CameraCollection():
 
     def __init__(self):
@@ -150,17 +343,26 @@ class CameraCollection():
         self.init_complete = False
         self.rig_centre_estimated = False
         self.rig_centre = None
+        self.calibration_hash = None
+        self.undistort_rays = False
+        # Compiled rig geometry per (ipd, origin), see compile
+        self.rig_geometry = {}
+        self.rig_geometry_state = None
+        self.planar_camera_positions_origin = None
 
     def sanityCheck(self):
         if not self.init_complete:
             raise RuntimeError('Camera collection is not initialized')
 
     def addCamera(self, camera):
+        camera.setUndistortRays(self.undistort_rays)
         self.camera_collection.append(camera)
         self.num_cameras = self.num_cameras + 1
+        self.invalidateGeometry()
 
     def readAllCameras(self, yaml):
         calib_data = load_camera_calibration_data(yaml)
+        self.calibration_hash = get_calibration_file_hash(yaml)
         num_cameras = len(calib_data)
 
         for i in range(num_cameras):
@@ -197,11 +399,84 @@ class CameraCollection():
             # print('new:' , new[0][3], new[2][3])
             # Position of cam_i with respect to cam0 in the xz plane
             self.planar_camera_positions[i, :] = curr_extrinsics[0][3], curr_extrinsics[2][3]
+        self.planar_camera_positions_origin = tuple(origin)
 
     def getCameraCentresXZ(self, origin):
-        self.updateCameraXZLocations(origin)
+        # Extrinsics are only chained again if the cameras or the origin changed
+        self.checkGeometryCache()
+        if self.planar_camera_positions_origin != tuple(origin):
+            self.updateCameraXZLocations(origin)
         return self.planar_camera_positions
 
+    def getGeometryState(self):
+        # Everything the compiled geometry is derived from
+        state = [np.asarray(self.camera_collection[0].extrinsics_absolute, dtype='float64').tobytes()]
+        for camera in self.camera_collection:
+            for value in [camera.extrinsics_relative, camera.intrinsics, camera.resolution]:
+                state.append(np.asarray(value, dtype='float64').tobytes())
+        return b''.join(state)
+
+    def getCameraStateHash(self):
+        """
+        SHA1 of everything rays and lookup tables are derived from: the geometry state, the distortion
+        coefficients and whether rays are undistorted. Changes with the cameras, also when they are
+        modified in memory.
+        """
+        state = [self.getGeometryState()]
+        for camera in self.camera_collection:
+            state.append(np.asarray(camera.distortion, dtype='float64').tobytes())
+        state.append(repr(bool(self.getUndistortRays())).encode('utf-8'))
+        return hashlib.sha1(b''.join(state)).hexdigest()
+
+    def checkGeometryCache(self):
+        state = self.getGeometryState()
+        if state != self.rig_geometry_state:
+            self.invalidateGeometry()
+            self.rig_geometry_state = state
+
+    def invalidateGeometry(self):
+        """
+        Drops the compiled rig geometry. Called automatically when the calibration of a camera
+        changes, call it explicitly after changing camera parameters in any other way.
+        """
+        self.rig_geometry = {}
+        self.rig_geometry_state = None
+        self.planar_camera_positions_origin = None
+        self.rig_centre_estimated = False
+
+    def __getstate__(self):
+        # Compiled geometry is memoized per IPD and rebuilt on demand, copies start without it
+        state = self.__dict__.copy()
+        state['rig_geometry'] = {}
+        state['rig_geometry_state'] = None
+        return state
+
+    def compile(self, ipd, origin=[0, 0, 0]):
+        """
+        Returns the RigGeometry for ipd and origin. Compiled geometry is memoized and recompiled
+        only when the cameras change.
+        """
+        self.checkGeometryCache()
+        key = (float(ipd), tuple([float(o) for o in origin]))
+        if key not in self.rig_geometry:
+            camera_positions = np.array(self.getCameraCentresXZ(origin), copy=True)
+            centre = np.array(self.getViewingCircleCentre(), copy=True)
+            cop_angles = getAngleArray(centre, camera_positions, ipd)
+            cop_columns_left = np.zeros(self.num_cameras)
+            cop_columns_right = np.zeros(self.num_cameras)
+            for i in range(self.num_cameras):
+                cop_columns_left[i] = self.camera_collection[i].getIncidentColumn(cop_angles[i], offsetByWidth=True)
+                cop_columns_right[i] = self.camera_collection[i].getIncidentColumn(cop_angles[i], offsetByWidth=False)
+            extrinsics = np.array([camera.extrinsics_absolute for camera in self.camera_collection], dtype='float64')
+
+            self.rig_geometry[key] = RigGeometry(float(ipd), key[1], extrinsics, camera_positions, centre,
+                self.getViewingCircleRadius(), cop_angles, cop_columns_left, cop_columns_right,
+                mapPointToODSAngleArray(camera_positions, centre, ipd, -1),
+                mapPointToODSAngleArray(camera_positions, centre, ipd, 1),
+                mapPointToODSColumnArray(camera_positions, centre, ipd, -1),
+                mapPointToODSColumnArray(camera_positions, centre, ipd, 1))
+        return self.rig_geometry[key]
+
     def getViewingCircleCentre(self):
         # Uncomment following line to set the viewing circle centre to the average of the cameras.
         # This works when all cameras are properly aligned in a circle.
@@ -224,6 +499,21 @@ class CameraCollection():
     def getNumCameras(self):
         return self.num_cameras
 
+    def setUndistortRays(self, undistort):
+        """
+        Generate rays with (True) or without (False) the lens distortion of every camera.
+        """
+        self.undistort_rays = undistort
+        for camera in self.camera_collection:
+            camera.setUndistortRays(undistort)
+
+    def getUndistortRays(self):
+        return self.undistort_rays
+
+    def getCalibrationHash(self):
+        # None when the cameras were not read from a calibration file
+        return self.calibration_hash
+
     def visualizeCameras(self, origin, ipd=0.062):
         self.updateCameraXZLocations(origin)
         centre = self.getViewingCircleCentre()
@@ -250,9 +540,11 @@ class CameraCollection():
         ax.scatter(viewing_circle[:, 0],viewing_circle[:, 1], color='red')
 
         # Plot left eye tangent points for the left eye
+        points_right = get2DPointOnODSVCArray(self.planar_camera_positions, centre, ipd, eye=1)
+        points_left = get2DPointOnODSVCArray(self.planar_camera_positions, centre, ipd, eye=-1)
         for i in range(self.num_cameras):
-            point_right = get2DPointOnODSVC(self.planar_camera_positions[i, :], centre, ipd, eye=1)
-            point_left = get2DPointOnODSVC(self.planar_camera_positions[i, :], centre, ipd, eye=-1)
+            point_right = points_right[i]
+            point_left = points_left[i]
             ax.scatter(point_right[0], point_right[1], color='orange')
             ax.annotate(str(i) + 'R', (point_right[0], point_right[1])
                 , xytext=(point_right[0]+0.0001, point_right[1]+0.0001))
@@ -265,10 +557,16 @@ class CameraCollection():
 def load_camera_calibration_data(file_name):
     with open(file_name, 'r') as stream:
         try:
-            calib_data = yaml.load(stream)
+            calib_data = yaml.safe_load(stream)
         except Exception as e:
             raise RuntimeError('Something bad happened when loading the .yaml file')
 
         return calib_data
 
 
+def get_calibration_file_hash(file_name):
+    """
+    Hash of the raw calibration file. Used to key lookup tables that only depend on the calibration.
+    """
+    with open(file_name, 'rb') as stream:
+        return hashlib.sha1(stream.read()).hexdigest()
@@ -1,8 +1,12 @@
 import numpy as np 
+import pickle
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 
 from cameras import *
 from RayGeometry import *
 from viewSynth import *
+from LookupTables import *
 import matplotlib.patches as mpatches
 
 
@@ -11,7 +15,32 @@ class RendererODS():
 		self.init_complete = False
 		self.color_list = ['green', 'blue', 'black', 'orange', 'red', 'cyan',
 		'magenta', 'darkgreen', 'purple', 'violet']
-		
+		# Column mapping tables, shared by all frames rendered with the same calibration
+		self.lut_cache = LookupTableCache()
+		self.lut_state_hash = None
+		# Rig geometry of the last render, see setupCamerasForRendering
+		self.rig_geometry = None
+		self.projection = 'linear'
+		# Optical flow of the camera pairs, shared by both eyes, all IPDs and re-renders
+		self.flow_calculator = OpticalFlowCalculator()
+		self.flow_cache = FlowCache()
+		# Flow is computed for the whole image unless a margin is set, see setFlowOverlapMargin
+		self.flow_margin = None
+		# Warm starts the flow of every pair from the previous frame when rendering video
+		self.temporal_flow = None
+		# Worker processes, kept between renders, see getWorkerPool
+		self.worker_pool = None
+		self.worker_pool_size = 0
+		self.worker_state_hash = None
+
+	def __getstate__(self):
+		# Worker processes get a copy of the renderer, but not the pool itself
+		state = self.__dict__.copy()
+		state['worker_pool'] = None
+		state['worker_pool_size'] = 0
+		state['worker_state_hash'] = None
+		return state
+
 	def jumpLinearInterpolation(self, theta_0, theta_1,theta_a, theta_b):
 		diff_b1=theta_1-theta_b
 		diff_0a=theta_0-theta_a
@@ -55,10 +84,9 @@ class RendererODS():
 				tps = tps*drange + t0
 			else:
 				t0 = t0+360
-				if abs(ta-t1) >= 270:
-					ta = ta+360
-				if abs(tb-t1) >= 270:
-					tb = tb+360
+				# Masks instead of if tests, so that ta and tb can also be arrays of angles
+				ta = np.where(np.abs(ta-t1) >= 270, ta+360, ta)
+				tb = np.where(np.abs(tb-t1) >= 270, tb+360, tb)
 				drange = t0-t1
 				t0s = (t0-t0)/drange
 				t1s = (t1-t0)/drange
@@ -81,25 +109,47 @@ class RendererODS():
 
 
 	def updateODSPanaroma(self, panaroma, temp_result):
-		num_cols = temp_result.shape[1]
-		for i in range(num_cols):
-			col_vals = temp_result[:, i, :]
-			sum_col_vals = np.sum(col_vals)
-			if sum_col_vals == 0:
-				panaroma[:, i, :] = panaroma[:, i, :] + temp_result[:, i, :]
-			else:
-				pan_sum = np.sum(panaroma[:, i, :])
-				if pan_sum == 0:
-					panaroma[:, i, :] = temp_result[:, i, :]
-				else:
-					panaroma[:, i, :] = 0.5*panaroma[:, i, :] + 0.5*temp_result[:, i, :]
+		"""
+		Running 50/50 blend of temp_result into panaroma, column by column. Kept for existing callers,
+		the renderers use PanaromaCompositor.
+		"""
+		new_cols = np.sum(temp_result, axis=(0, 2)) != 0
+		pan_cols = np.sum(panaroma, axis=(0, 2)) != 0
+		copy_cols = new_cols & np.logical_not(pan_cols)
+		blend_cols = new_cols & pan_cols
+		panaroma[:, copy_cols, :] = temp_result[:, copy_cols, :]
+		panaroma[:, blend_cols, :] = 0.5*panaroma[:, blend_cols, :] + 0.5*temp_result[:, blend_cols, :]
 		return panaroma
 
+	def getJobBlendWeights(self, job, pan_width, eye, blend='average', rig=None):
+		"""
+		Column blend weights for the partial image of a view interpolation job. 'average' weighs all
+		partial images the same, 'feather' weighs columns by their distance from the column where the
+		job's first camera is mapped in the panaroma. rig defaults to the current rig geometry.
+		"""
+		if rig is None:
+			rig = self.rig_geometry
+		if blend == 'average':
+			return None
+		elif blend == 'feather':
+			cameraLeftID, cameraRightID, direction = job[0:3]
+			if direction == 'left2right':
+				camFirst = cameraLeftID
+			else:
+				camFirst = cameraRightID
+			xn = rig.getODSPositions(eye)[camFirst]
+			return getFeatherWeights(pan_width, unnormalizeX(xn, pan_width))
+		else:
+			raise RuntimeError('Unknown blend type : ', blend)
+
 
 	def setCameraList(self, camera_collection):
 		self.camera_list = camera_collection
-		self.camera_order = range(self.camera_list.getNumCameras())
+		self.camera_order = list(range(self.camera_list.getNumCameras()))
 		self.camera_order.append(0)
+		self.rig_geometry = None
+		self.lut_cache.clear()
+		self.lut_state_hash = None
 		self.init_complete = True
 
 	def setCameraOrder(self, camera_order):
@@ -108,6 +158,152 @@ class RendererODS():
 	def setImageList(self, image_collection):
 		self.image_list = image_collection
 
+	def setLookupTableDirectory(self, cache_dir):
+		self.lut_cache.setCacheDirectory(cache_dir)
+
+	def setFlowBackend(self, name):
+		"""
+		Optical flow backend by name ('farneback', 'dis_medium', 'dis_fast', 'dis_ultrafast',
+		'sparse_to_dense') or tier ('quality', 'balanced', 'fast', 'fastest').
+		"""
+		self.flow_calculator = createOpticalFlowCalculator(name)
+
+	def setFlowPyramidLevel(self, level, refine=False):
+		self.flow_calculator.setPyramidLevel(level, refine)
+
+	def chooseFlowPyramidLevel(self, time_budget, frameIDLeft=0, frameIDRight=1, levels=[0, 1, 2, 3]):
+		"""
+		Profiles the flow backend at every pyramid level on a pair of the current images and uses the
+		finest level that computes the flow of one pair within time_budget seconds. Returns the level.
+		"""
+		imageLeft = self.image_list[frameIDLeft].getImage()
+		imageRight = self.image_list[frameIDRight].getImage()
+		self.flow_calculator.profilePyramidLevels(imageLeft, imageRight, levels)
+		return self.flow_calculator.choosePyramidLevel(time_budget)
+
+	def setFlowOverlapMargin(self, margin):
+		"""
+		Computes flow only for the columns read by the view interpolation plus margin (in pixels).
+		This is faster, but flow near the edges of the band and the coarse pyramid levels differ
+		from full frame flow, so the output is close to but not identical with a full frame render.
+		The band covers the IPDs of one render, so a sweep can also differ slightly from separate
+		renders. None (the default) computes flow for the whole image.
+		"""
+		self.flow_margin = margin
+
+	def setFlowCacheDirectory(self, cache_dir, fixed_point=False):
+		self.flow_cache.setCacheDirectory(cache_dir)
+		self.flow_cache.fixed_point = fixed_point
+
+	def setTemporalFlow(self, enabled, scene_cut_ratio=2.0, max_warm_frames=30):
+		"""
+		Enables warm starting the flow of every pair with its flow in the previous frame, see
+		TemporalFlow. Only useful when the frames are rendered in order, e.g. by SequenceRenderer.
+		Enabling always starts from an empty state.
+		"""
+		if enabled:
+			self.temporal_flow = TemporalFlow(scene_cut_ratio, max_warm_frames=max_warm_frames)
+		else:
+			self.temporal_flow = None
+
+	def getPairFlowState(self, pair):
+		# Temporal flow state of a (cameraLeftID, cameraRightID, direction) pair, None if not enabled
+		if self.temporal_flow is None:
+			return None
+		return self.temporal_flow.getState(pair)
+
+	def setPairFlowState(self, pair, state):
+		if self.temporal_flow is not None:
+			self.temporal_flow.setState(pair, state)
+
+	def setProjection(self, projection):
+		"""
+		Vertical mapping of the panaroma. 'linear' copies the image rows and scales them linearly when
+		the output height differs from the camera height. 'equirectangular' maps every pixel to the
+		row of its elevation, so the output height can be chosen independently of the cameras
+		(2*height == width covers the full sphere).
+		"""
+		if projection not in ['linear', 'equirectangular']:
+			raise RuntimeError('Unknown projection : ', projection)
+		self.projection = projection
+
+	def getLookupTableKey(self):
+		"""
+		Identifies the camera state (calibration, in memory changes, undistortion) lookup tables are
+		built from. Tables of an earlier state are dropped from memory when it changes.
+		"""
+		state_hash = self.camera_list.getCameraStateHash()
+		if state_hash != self.lut_state_hash:
+			self.lut_cache.clear()
+			self.lut_state_hash = state_hash
+		return state_hash
+
+	def getColumnLUT(self, camera_id, ipd, eye, pan_width, origin=[0, 0, 0]):
+		viewing_circle_centre = self.camera_list.compile(ipd, origin).viewing_circle_centre
+		key = (self.getLookupTableKey(), camera_id, eye, float(ipd), int(pan_width), tuple(origin))
+		return self.lut_cache.getTable('column_lut', key,
+			lambda: buildColumnLUT(self.camera_list[camera_id], viewing_circle_centre, ipd, eye, pan_width))
+
+	def getRowLUT(self, camera_id, ipd, out_height, origin=[0, 0, 0]):
+		rig = self.camera_list.compile(ipd, origin)
+		key = (self.getLookupTableKey(), camera_id, float(ipd), int(out_height), tuple(origin))
+		return self.lut_cache.getTable('row_lut', key,
+			lambda: buildRowLUT(self.camera_list[camera_id], rig.viewing_circle_centre,
+				rig.viewing_circle_height, ipd, out_height))
+
+	def getInverseRowTable(self, camera_id, ipd, out_height, origin=[0, 0, 0]):
+		rig = self.camera_list.compile(ipd, origin)
+		key = (self.getLookupTableKey(), camera_id, float(ipd), int(out_height), tuple(origin))
+		return self.lut_cache.getTable('inverse_row_table', key,
+			lambda: buildInverseRowTable(self.camera_list[camera_id], rig.viewing_circle_centre,
+				rig.viewing_circle_height, ipd, out_height))
+
+	def getSourceRows(self, camera_id, ipd, out_height, source_cols, origin=[0, 0, 0], cache_table=True):
+		"""
+		Source rows (map_y for cv2.remap) for panaroma columns that are fed by the given sub pixel
+		source columns of one camera. Returns a (out_height, len(source_cols)) float32 array.
+		With cache_table=False the equirectangular row table is built only for the image columns
+		needed here and not kept, so memory stays proportional to len(source_cols).
+		"""
+		if self.projection == 'equirectangular':
+			image_width = int(self.camera_list[camera_id].resolution[0])
+			# Linear interpolation between the two neighbouring image columns of the table
+			col_0 = np.clip(np.floor(source_cols).astype('int32'), 0, image_width-2)
+			t = (source_cols - col_0)[np.newaxis, :]
+			if cache_table:
+				table = self.getInverseRowTable(camera_id, ipd, out_height, origin)
+				rows_0 = table[:, col_0]
+				rows_1 = table[:, col_0 + 1]
+			else:
+				rig = self.camera_list.compile(ipd, origin)
+				table_cols, index = np.unique(np.concatenate((col_0, col_0 + 1)), return_inverse=True)
+				table = buildInverseRowTable(self.camera_list[camera_id], rig.viewing_circle_centre,
+					rig.viewing_circle_height, ipd, out_height, table_cols)
+				rows_0 = table[:, index[0:len(col_0)]]
+				rows_1 = table[:, index[len(col_0):]]
+			rows = (1 - t)*rows_0 + t*rows_1
+			# Outside of the image in either column
+			rows[(rows_0 < 0) | (rows_1 < 0)] = -1
+			return rows.astype('float32')
+		row_map = buildRowMap(self.camera_list[camera_id], out_height)
+		return np.repeat(row_map[:, np.newaxis], len(source_cols), axis=1)
+
+	def scaleRowsToPanaroma(self, image, pan_height, interpolation=cv2.INTER_LINEAR):
+		"""
+		Linear projection: scales the rows of an image rendered at the camera height to the panaroma
+		height, like buildRowMap. Columns are not touched, so empty columns stay empty.
+		"""
+		pan_height = int(pan_height)
+		if image.shape[0] == pan_height:
+			return image
+		return cv2.resize(image, (image.shape[1], pan_height), interpolation=interpolation)
+
+	def getRemapBorderMode(self):
+		# Equirectangular maps point outside the images above and below the cameras
+		if self.projection == 'equirectangular':
+			return cv2.BORDER_CONSTANT
+		return cv2.BORDER_REPLICATE
+
 	def sanityCheck(self):
 		if not self.init_complete:
 			raise RuntimeError('Camera collection is not initialized')
@@ -118,27 +314,15 @@ class RendererODS():
 			width = out_image_dim[1]
 			output_image = np.zeros((out_image_dim[0], out_image_dim[1], 3), dtype='uint8')
 
-			camera_positions = self.camera_list.getCameraCentresXZ(origin)
-			viewing_circle_centre = self.camera_list.getViewingCircleCentre()
-			camera_rig_radius = self.camera_list.getViewingCircleRadius()
-
-			if ipd > camera_rig_radius:
-				raise RuntimeError('IPD cannot be greater than the radius of the viewing circle')
+			rig = self.setupCamerasForRendering(ipd, origin)
+			camera_positions = rig.camera_positions
+			viewing_circle_centre = rig.viewing_circle_centre
 
 			nc = self.camera_list.getNumCameras()
 			# Plots, plots and more plots
 			fig, ax = pyplt.subplots()
 			ax.hold('on')
 			for i in range(0, nc):
-				theta = getAngle(viewing_circle_centre, camera_positions[i, :], ipd)
-				self.camera_list[i].setCOPRelativeAngleRight(theta)
-				self.camera_list[i].setCOPRelativeAngleLeft(theta)
-				xn_right = mapPointToODSColumn(camera_positions[i, :], viewing_circle_centre, ipd, 1)
-				xn_left = mapPointToODSColumn(camera_positions[i, :], viewing_circle_centre, ipd, -1)
-				self.camera_list[i].setPositionInODSImageRight(xn_right)
-				self.camera_list[i].setPositionInODSImageLeft(xn_left)
-
-				
 				# Plot origin and the viewing circle centre.
 				ax.scatter(0, 0)
 				ax.annotate('O', (0, 0))
@@ -156,24 +340,19 @@ class RendererODS():
 			legend_labels = []
 			for i in range(0, 10):
 				image_width = int(self.camera_list[i].resolution[0])
-				if eye is 1:
-					xn = self.camera_list[i].getPositionInODSImageRight()
-					col_img = self.camera_list[i].getCOPRight()
+				xn = rig.getODSPositions(eye)[i]
+				if eye == 1:
+					col_img = rig.cop_columns_right[i]
 				else:
-					xn = self.camera_list[i].getPositionInODSImageLeft()
-					col_img = self.camera_list[i].getCOPLeft()
+					col_img = rig.cop_columns_left[i]
 				col_index = int(unnormalizeX(xn, width))
 				print(col_img, image_width)
-				for j in range(0, image_width):
-					point_in_3d = self.camera_list[i].getRayForPixelInGlobalRef(j, 0)
-					p3d = np.asarray((point_in_3d[0], point_in_3d[2]))
-					point = get2DPointOnODSVC(p3d, viewing_circle_centre, ipd, eye)
-					# Find where these rays map onto the ODS panaroma
-					xn_new = mapPointToODSColumn(p3d, viewing_circle_centre, ipd, eye)
-					# print(xn, xn_new)
-					# Plot where the start, middle and end of an image are mapped in the global frame of reference
-					ax.scatter(point_in_3d[0], point_in_3d[2], color=self.color_list[i])
-					ax.scatter(point[0], point[1], color=self.color_list[i])
+				points_in_3d = self.camera_list[i].getColumnRays()
+				p3d = points_in_3d[:, [0, 2]]
+				points = get2DPointOnODSVCArray(p3d, viewing_circle_centre, ipd, eye)
+				# Plot where the start, middle and end of an image are mapped in the global frame of reference
+				ax.scatter(p3d[:, 0], p3d[:, 1], color=self.color_list[i])
+				ax.scatter(points[:, 0], points[:, 1], color=self.color_list[i])
 				# Set legend labels
 				legend_labels.append(mpatches.Patch(color=self.color_list[i], label='cam ' + str(i)))
 			pyplt.legend(handles=legend_labels)
@@ -186,293 +365,645 @@ class RendererODS():
 		pan_width = out_image_dim[1]
 		output_image = np.zeros((out_image_dim[0], out_image_dim[1], 3), dtype='uint8')
 		nc = self.camera_list.getNumCameras()
-		image_stacker = np.zeros((out_image_dim[0], out_image_dim[1], 3, nc), dtype='uint8')
 
-		camera_positions = self.camera_list.getCameraCentresXZ(origin)
-		viewing_circle_centre = self.camera_list.getViewingCircleCentre()
-		rig_radius = self.camera_list.getViewingCircleRadius()
-
-		if ipd > rig_radius:
-			raise RuntimeError('IPD cannot be greater than the radius of the camera rig.')
+		self.setupCamerasForRendering(ipd, origin)
 
 		for i in range(0, nc):
-			theta = getAngle(viewing_circle_centre, camera_positions[i, :], ipd)
-			self.camera_list[i].setCOPRelativeAngleRight(theta)
-			self.camera_list[i].setCOPRelativeAngleLeft(theta)
-			
-			xn_right = mapPointToODSColumn(camera_positions[i, :], viewing_circle_centre, ipd, eye=1)
-			xn_left = mapPointToODSColumn(camera_positions[i, :], viewing_circle_centre, ipd, eye=-1)
-			self.camera_list[i].setPositionInODSImageRight(xn_right)
-			self.camera_list[i].setPositionInODSImageLeft(xn_left)
-
-			if eye is 1:
-				xn = xn_right
+			# Panaroma column for every column of this camera. Built once per calibration and reused.
+			column_lut = self.getColumnLUT(i, ipd, eye, pan_width, origin)
+
+			# Copy all columns to the final panaroma in one go. When several columns land on the
+			# same panaroma column, the last one wins like in the per column loop.
+			if self.projection == 'equirectangular':
+				# Temporary image that holds the render result just for this camera
+				temp_image = np.zeros((out_image_dim[0], out_image_dim[1], 3), dtype='uint8')
+				row_lut = self.getRowLUT(i, ipd, height, origin)
+				temp_image[row_lut, column_lut[np.newaxis, :], :] = self.image_list[i].getImage()[:, 0:column_lut.shape[0], :]
 			else:
-				xn = xn_left
-
-			col_index = int(unnormalizeX(xn, pan_width))
-			# Map this camera to an angle on the viewing circle.
-			cam_theta = mapPointToODSAngle(camera_positions[i, :], viewing_circle_centre, ipd, eye)
-
-			print('camera ', i, 'maps to: ', 'angle: ', radians2Degrees(cam_theta), 'column: ',  col_index)
-			
-			print('Rendering camera ', i)
-			# Temporary image that holds the render result just for this camera
-			temp_image = np.zeros((out_image_dim[0], out_image_dim[1], 3), dtype='uint8')
-			# Go over all columns in the image and get a ray for each column.
-			for col in range(0, int(self.camera_list[i].resolution[0])):
-				# Setting row index to zero, because it doesn't really matter
-				global_ray = self.camera_list[i].getRayForPixelInGlobalRef(col, 0)
-				# Store the XZ co-ordinates of the global ray separately for easy processing
-				global_ray_xz = np.asarray([global_ray[0], global_ray[2]])
-				# Find the angle for this ray in the global frame of reference
-				theta_ray = mapPointToODSAngle(global_ray_xz, viewing_circle_centre, ipd, eye)
-				# Find the normalized column co-ordinate for this ray in the global panaroma
-				xn_ray = mapPointToODSColumn( global_ray_xz, viewing_circle_centre, ipd, eye)
-
-				# Unnormalize this column to the width of the panaroma
-				panaroma_col_index = int(unnormalizeX(xn_ray, pan_width))
-				# Get the image for this camera
-				current_image = self.image_list[i]
-				# Copy column to the final panaroma
-				temp_image[:, panaroma_col_index, :] = current_image.getColumn(col)
-
-			cv2.imshow('Temporary result:', temp_image)
-			cv2.waitKey(50)
-			# Stack rendering results to average later
-			image_stacker[:, :, :, i] = temp_image
-
-		# Final image is some combination of the stack
-		output_image = np.uint8(np.max(image_stacker, axis=3))
+				image = self.image_list[i].getImage()
+				temp_image = np.zeros((image.shape[0], out_image_dim[1], 3), dtype='uint8')
+				temp_image[:, column_lut, :] = image[:, 0:column_lut.shape[0], :]
+				temp_image = self.scaleRowsToPanaroma(temp_image, height)
+
+			# Final image is the maximum over all camera renders
+			np.maximum(output_image, temp_image, out=output_image)
+
 		return output_image
 
 
-	# View interpolater - One flow vector for an entire column
-	def viewInterpolationCwise(self, cameraLeftID, cameraRightID, frameIDLeft, frameIDRight, pan_width, 
-		direction='left2right', origin=[0, 0, 0], ipd=0.062, eye=-1):
-		# Do sanity checks
-		# Check if all IDs are valid.
-		camLeft = self.camera_list[cameraLeftID]
-		camRight = self.camera_list[cameraRightID]
-		imageLeft = self.image_list[frameIDLeft].getImage()
-		imageRight = self.image_list[frameIDRight].getImage()
+	def getInverseColumnMap(self, ipd, eye, pan_width, origin=[0, 0, 0]):
+		viewing_circle_centre = self.camera_list.compile(ipd, origin).viewing_circle_centre
+		key = (self.getLookupTableKey(), eye, float(ipd), int(pan_width), tuple(origin))
+		return self.lut_cache.getTable('inverse_column_map', key,
+			lambda: buildInverseColumnMap(self.camera_list, viewing_circle_centre, ipd, eye, pan_width))
+
+	def getRemapMaps(self, camera_id, ipd, eye, out_image_dim, origin=[0, 0, 0]):
+		"""
+		cv2.remap maps for the panaroma columns fed by one camera. Returns (columns, map_x, map_y)
+		where columns are the panaroma columns and map_x/map_y have shape (height, len(columns)).
+		Maps are only kept in memory, they are cheap to expand from the cached column map.
+		"""
+		height = int(out_image_dim[0])
+		pan_width = int(out_image_dim[1])
+
+		def buildMaps():
+			column_map = self.getInverseColumnMap(ipd, eye, pan_width, origin)
+			columns = np.nonzero(column_map[0] == camera_id)[0]
+			map_x = np.repeat(column_map[1, columns][np.newaxis, :], height, axis=0)
+			map_y = self.getSourceRows(camera_id, ipd, height, column_map[1, columns], origin)
+			return np.stack((map_x, map_y)), columns
+
+		key = (self.getLookupTableKey(), self.projection, camera_id, eye, float(ipd), height, pan_width,
+			tuple(origin))
+		maps, columns = self.lut_cache.getTable('remap_maps', key, buildMaps, persistent=False)
+		return columns, maps[0], maps[1]
+
+	def render360InverseMapping(self, ipd, out_image_dim, eye=1, origin=[0, 0, 0]):
+		"""
+		Output driven render without view interpolation. Every panaroma column is looked up in the
+		camera that feeds it, so there are no holes inside the area covered by the cameras. Each
+		camera is sampled with one bilinear cv2.remap over the columns it feeds, using maps that
+		are cached across frames.
+		"""
+		self.sanityCheck()
+		height = out_image_dim[0]
+		pan_width = out_image_dim[1]
+		output_image = np.zeros((height, pan_width, 3), dtype='uint8')
+		nc = self.camera_list.getNumCameras()
 
-		# Resolution of both the left and right are assumed to be the same. Taking the left image
-		# here as the reference.
-		image_width = camLeft.resolution[0]
-		image_height = camLeft.resolution[1]
-		output_image = np.zeros((int(image_height), int(pan_width), 3), dtype='uint8')
+		# Updates the absolute extrinsics of the cameras
+		self.setupCamerasForRendering(ipd, origin)
 
-		# get and store renderer globals locally for computation
-		camera_positions = self.camera_list.getCameraCentresXZ(origin)
-		viewing_circle_centre = self.camera_list.getViewingCircleCentre()
-		camera_rig_radius = self.camera_list.getViewingCircleRadius()
-
-		cameraLeftPosition = camera_positions[cameraLeftID]
-		cameraRightPosition = camera_positions[cameraRightID]
-
-		# Find where the two incoming cameras map onto the viewing circle. These form theta_0 and theta_1
-		theta_0 = mapPointToODSAngle(cameraLeftPosition, viewing_circle_centre, ipd, eye)
-		theta_1 = mapPointToODSAngle(cameraRightPosition, viewing_circle_centre, ipd, eye)
-		theta_0_degree = radians2Degrees360(theta_0)
-		theta_1_degree = radians2Degrees360(theta_1)
-
-		if direction is 'left2right':
-			start_col = camLeft.getCOPLeft()
-			end_col = image_width
-			camFirst = camLeft
-			camSecond = camRight
-			imageFirst = imageLeft
-			imageSecond = imageRight
-		elif direction is 'right2left':
-			start_col = 0
-			end_col = camLeft.getCOPLeft()
-			camFirst = camRight
-			camSecond = camLeft
-			imageFirst = imageRight
-			imageSecond = imageLeft
-		else:
-			raise RuntimeError('Unsupported view interpolation direction : ', direction)
+		for i in range(0, nc):
+			columns, map_x, map_y = self.getRemapMaps(i, ipd, eye, out_image_dim, origin)
+			if columns.shape[0] == 0:
+				continue
+			output_image[:, columns, :] = cv2.remap(self.image_list[i].getImage(), map_x, map_y,
+				cv2.INTER_LINEAR, borderMode=self.getRemapBorderMode())
 
-		# Debug prints
-		# print('start_col: ', start_col, '\tend col: ', end_col)
-		# print('theta_0: ', theta_0_degree, '\ttheta_1: ', theta_1_degree)
+		return output_image
 
-		# Optical flow calculator
-		of = OpticalFlowCalculator()
-		flow = of.calculateFlow(imageFirst, imageSecond)
 
-		for col_id in range(start_col, end_col):
-			ray_first = camFirst.getRayForPixelInGlobalRef(col_id, 0)
-			ray_first_xz = np.asarray((ray_first[0], ray_first[2]), dtype='float32')
-			theta_a = mapPointToODSAngle(ray_first_xz, viewing_circle_centre, ipd, eye)
-			theta_a_degree = radians2Degrees360(theta_a)
+	def render360Tiled(self, ipd, out_image_dim, eye=1, origin=[0, 0, 0], memory_budget=256*1024*1024,
+		out=None, out_file=None):
+		"""
+		Memory bounded version of render360InverseMapping for large panaromas. The panaroma is
+		rendered in vertical strips (ranges of yaw). Each strip is sampled only from the cameras that
+		feed it and written straight into the output, which can be a preallocated array, or a
+		memory mapped .npy file when out_file is given. memory_budget (in bytes) caps the size of the
+		per strip temporaries, including the equirectangular row tables, which are built per strip
+		instead of for whole cameras.
+		"""
+		self.sanityCheck()
+		height = int(out_image_dim[0])
+		pan_width = int(out_image_dim[1])
+		if out is None:
+			if out_file is not None:
+				out = np.lib.format.open_memmap(out_file, mode='w+', dtype='uint8', shape=(height, pan_width, 3))
+			else:
+				out = np.zeros((height, pan_width, 3), dtype='uint8')
+		elif out.shape != (height, pan_width, 3):
+			raise RuntimeError('Output buffer must have shape (height, width, 3)')
+
+		# Updates the absolute extrinsics of the cameras
+		self.setupCamerasForRendering(ipd, origin)
+
+		# Only column and row tables are kept for the whole panaroma, 2D maps exist per strip
+		column_map = self.getInverseColumnMap(ipd, eye, pan_width, origin)
+		camera_ids = column_map[0].astype('int32')
+
+		# Per strip column: map_x and map_y (float32), the strip image and the remap result (uint8)
+		bytes_per_column = height*(4 + 4 + 3 + 3)
+		if self.projection == 'equirectangular':
+			# Row table of up to two image columns per strip column (float32) with its float64 targets,
+			# interpolation result and inside mask, plus rows_0, rows_1 and their blend (float32)
+			bytes_per_column += height*(2*(4 + 8 + 8 + 1) + 3*4)
+		strip_width = int(max(1, min(pan_width, memory_budget // bytes_per_column)))
+
+		for strip_start in range(0, pan_width, strip_width):
+			strip_end = min(strip_start + strip_width, pan_width)
+			strip_ids = camera_ids[strip_start:strip_end]
+			strip_image = np.zeros((height, strip_end - strip_start, 3), dtype='uint8')
+			for i in np.unique(strip_ids[strip_ids >= 0]):
+				columns = np.nonzero(strip_ids == i)[0]
+				map_x = np.repeat(column_map[1, strip_start + columns][np.newaxis, :], height, axis=0)
+				map_y = self.getSourceRows(i, ipd, height, column_map[1, strip_start + columns], origin,
+					cache_table=False)
+				strip_image[:, columns, :] = cv2.remap(self.image_list[i].getImage(), map_x, map_y,
+					cv2.INTER_LINEAR, borderMode=self.getRemapBorderMode())
+			out[:, strip_start:strip_end, :] = strip_image
+
+		return out
 
-			# Get horizontal flow for the current column
-			col_flow = flow[:, col_id, 1]
-			mean_flow = np.mean(col_flow)
 
-			col_id_correspondence = col_id + mean_flow
-			ray_second = camSecond.getRayForPixelInGlobalRef(col_id_correspondence, 0)
-			ray_second_xz = np.asarray((ray_second[0], ray_second[2]), dtype='float32')
-			theta_b = mapPointToODSAngle(ray_second_xz, viewing_circle_centre, ipd, eye)
-			theta_b_degree = radians2Degrees360(theta_b)
+	# View interpolater - One flow vector for an entire column
+	def viewInterpolationCwise(self, cameraLeftID, cameraRightID, frameIDLeft, frameIDRight, pan_width, 
+		direction='left2right', origin=[0, 0, 0], ipd=0.062, eye=-1, flow=None, pan_height=None):
+		return self.viewInterpolationCwiseSweep(cameraLeftID, cameraRightID, frameIDLeft, frameIDRight, pan_width,
+			direction, origin, [ipd], eye, flow, pan_height)[0]
+
+	def viewInterpolationCwiseSweep(self, cameraLeftID, cameraRightID, frameIDLeft, frameIDRight, pan_width,
+		direction='left2right', origin=[0, 0, 0], ipds=[0.062], eye=-1, flow=None, pan_height=None):
+		"""
+		Column wise view interpolation of one pair for a list of IPDs, returns one partial image per
+		IPD. Flow and rays do not depend on the IPD and are computed once, the tangent angles are
+		computed for all IPDs together.
+		"""
+		# Do sanity checks
+		# Check if all IDs are valid.
+		camLeft = self.camera_list[cameraLeftID]
 
-			theta_p_degree = self.normalizeThenInterpolate(theta_0_degree, theta_1_degree, theta_a_degree, theta_b_degree, eye)
-			theta_p = degrees3602Radians(theta_p_degree)
+		# Resolution of both the left and right are assumed to be the same. Taking the left image
+		# here as the reference.
+		image_width = int(camLeft.resolution[0])
+		image_height = int(camLeft.resolution[1])
+		if pan_height is None:
+			pan_height = image_height
+		# With the linear projection image rows are copied 1:1 and the partial is scaled afterwards
+		partial_height = image_height if self.projection == 'linear' else pan_height
+
+		(cameraFirstID, cameraSecondID, frameIDFirst, start_cols, end_cols,
+			theta_0_degrees, theta_1_degrees, viewing_circle_centre) = self.getSweepPairGeometry(cameraLeftID,
+			cameraRightID, frameIDLeft, frameIDRight, image_width, direction, origin, ipds, eye)
+		camFirst = self.camera_list[cameraFirstID]
+		camSecond = self.camera_list[cameraSecondID]
+		imageFirst = self.image_list[frameIDFirst].getImage()
+
+		# Optical flow between the two images. It does not depend on the eye, so callers rendering
+		# both eyes pass it in.
+		if flow is None:
+			flow = self.calculatePairFlow(frameIDLeft, frameIDRight, direction,
+				self.getPairFlowColumns(cameraLeftID, direction, ipds, origin))
+
+		# All columns that any of the IPDs needs are processed at once, every column is represented by
+		# the ray of its strip row (see Camera.getColumnStripRow)
+		start_col = min(start_cols)
+		end_col = max(end_cols)
+		col_ids = np.arange(start_col, end_col)
+		strip_rows = np.full(col_ids.shape, camSecond.getColumnStripRow())
+		rays_first = camFirst.getColumnRays()[start_col:end_col]
+
+		# Mean horizontal flow of every column
+		mean_flow = np.mean(flow[:, start_col:end_col, 1], axis=0)
+
+		col_ids_correspondence = col_ids + mean_flow
+		rays_second = camSecond.getRaysForPixelsInGlobalRef(col_ids_correspondence, strip_rows)
+
+		# Tangent angles for all IPDs, with the IPD along the first axis
+		ipd_array = np.asarray(ipds, dtype='float64')[:, np.newaxis]
+		theta_a = mapPointToODSAngleArray(rays_first[:, [0, 2]], viewing_circle_centre, ipd_array, eye)
+		theta_a_degrees = radians2Degrees360Array(theta_a)
+		theta_b = mapPointToODSAngleArray(rays_second[:, [0, 2]], viewing_circle_centre, ipd_array, eye)
+		theta_b_degrees = radians2Degrees360Array(theta_b)
+
+		output_images = []
+		for k in range(len(ipds)):
+			cols = slice(start_cols[k] - start_col, end_cols[k] - start_col)
+			theta_p_degree = self.normalizeThenInterpolate(theta_0_degrees[k], theta_1_degrees[k],
+				theta_a_degrees[k, cols], theta_b_degrees[k, cols], eye)
+			theta_p = degrees3602RadiansArray(theta_p_degree)
 
 			xn_new = thetaToNormalizedX(theta_p)
 			# Make sure xn_new is between 0 and 1.
 			xn_new = np.clip(xn_new, 0, 1)
-			ods_column = int(unnormalizeX(xn_new, pan_width))
-			# print(col_id, theta_a_degree, theta_b_degree, theta_p_degree, ods_column)
-			output_image[:, ods_column, :] = imageFirst[:, col_id, :]
+			ods_columns = np.minimum(unnormalizeX(xn_new, pan_width).astype('int32'), int(pan_width)-1)
+
+			output_image = np.zeros((int(partial_height), int(pan_width), 3), dtype='uint8')
+			# Later columns overwrite earlier ones that land on the same ODS column, as in a column loop
+			if self.projection == 'equirectangular':
+				# Gather every output row from the image row with the same elevation
+				row_table = self.getInverseRowTable(cameraFirstID, ipds[k], pan_height, origin)
+				src_rows = np.rint(row_table[:, start_cols[k]:end_cols[k]]).astype('int32')
+				column_pixels = imageFirst[np.maximum(src_rows, 0), col_ids[np.newaxis, cols]]
+				column_pixels[src_rows < 0] = 0
+				output_image[:, ods_columns, :] = column_pixels
+			else:
+				output_image[:, ods_columns, :] = imageFirst[:, start_cols[k]:end_cols[k], :]
+				output_image = self.scaleRowsToPanaroma(output_image, pan_height)
+			output_images.append(output_image)
 
-		return output_image
+		return output_images
 
 	# View interpoaltion: Per pixel flow
 	def viewInterpolationPixelwise(self, cameraLeftID, cameraRightID, frameIDLeft, frameIDRight, pan_width, 
-		direction='left2right', origin=[0, 0, 0], ipd=0.062, eye=-1):
+		direction='left2right', origin=[0, 0, 0], ipd=0.062, eye=-1, flow=None, pan_height=None):
+		return self.viewInterpolationPixelwiseSweep(cameraLeftID, cameraRightID, frameIDLeft, frameIDRight,
+			pan_width, direction, origin, [ipd], eye, flow, pan_height)[0]
+
+	def viewInterpolationPixelwiseSweep(self, cameraLeftID, cameraRightID, frameIDLeft, frameIDRight, pan_width,
+		direction='left2right', origin=[0, 0, 0], ipds=[0.062], eye=-1, flow=None, pan_height=None):
+		"""
+		Pixel wise version of viewInterpolationCwiseSweep.
+		"""
 		# Do sanity checks
 		# Check if all IDs are valid.
 		camLeft = self.camera_list[cameraLeftID]
-		camRight = self.camera_list[cameraRightID]
-		imageLeft = self.image_list[frameIDLeft].getImage()
-		imageRight = self.image_list[frameIDRight].getImage()
 
 		# Resolution of both the left and right are assumed to be the same. Taking the left image
 		# here as the reference.
-		image_width = camLeft.resolution[0]
-		image_height = camLeft.resolution[1]
-		output_image = np.zeros((int(image_height), int(pan_width), 3), dtype='uint8')
+		image_width = int(camLeft.resolution[0])
+		image_height = int(camLeft.resolution[1])
+		if pan_height is None:
+			pan_height = image_height
+		# With the linear projection image rows are copied 1:1 and the partial is scaled afterwards
+		partial_height = image_height if self.projection == 'linear' else pan_height
+
+		(cameraFirstID, cameraSecondID, frameIDFirst, start_cols, end_cols,
+			theta_0_degrees, theta_1_degrees, viewing_circle_centre) = self.getSweepPairGeometry(cameraLeftID,
+			cameraRightID, frameIDLeft, frameIDRight, image_width, direction, origin, ipds, eye)
+		camFirst = self.camera_list[cameraFirstID]
+		camSecond = self.camera_list[cameraSecondID]
+		imageFirst = self.image_list[frameIDFirst].getImage()
+
+		# Optical flow between the two images. It does not depend on the eye, so callers rendering
+		# both eyes pass it in.
+		if flow is None:
+			flow = self.calculatePairFlow(frameIDLeft, frameIDRight, direction,
+				self.getPairFlowColumns(cameraLeftID, direction, ipds, origin))
+
+		# Whole image grids of all columns that any of the IPDs needs, indexed [col, row] so that
+		# flattening them gives the same order as a loop over columns with an inner loop over rows.
+		start_col = min(start_cols)
+		end_col = max(end_cols)
+		col_ids, row_ids = np.meshgrid(np.arange(start_col, end_col), np.arange(0, image_height), indexing='ij')
+		# Cached bundle is indexed [row, col]
+		rays_first = camFirst.getRayBundle()[:, start_col:end_col].transpose(1, 0, 2)
+
+		# Per pixel flow correspondences
+		ver_flow = flow[row_ids, col_ids, 0]
+		hor_flow = flow[row_ids, col_ids, 1]
+		col_ids_correspondence = col_ids + hor_flow
+		row_ids_correspondence = row_ids + ver_flow
+		rays_second = camSecond.getRaysForPixelsInGlobalRef(col_ids_correspondence, row_ids_correspondence)
+
+		# Tangent angles for all IPDs, with the IPD along the first axis
+		ipd_array = np.asarray(ipds, dtype='float64')[:, np.newaxis, np.newaxis]
+		theta_a = mapPointToODSAngleArray(rays_first[..., [0, 2]], viewing_circle_centre, ipd_array, eye)
+		theta_a_degrees = radians2Degrees360Array(theta_a)
+		theta_b = mapPointToODSAngleArray(rays_second[..., [0, 2]], viewing_circle_centre, ipd_array, eye)
+		theta_b_degrees = radians2Degrees360Array(theta_b)
+
+		output_images = []
+		for k in range(len(ipds)):
+			cols = slice(start_cols[k] - start_col, end_cols[k] - start_col)
+			theta_p_degree = self.normalizeThenInterpolate(theta_0_degrees[k], theta_1_degrees[k],
+				theta_a_degrees[k, cols], theta_b_degrees[k, cols], eye)
+			theta_p = degrees3602RadiansArray(theta_p_degree)
 
-		# get and store renderer globals locally for computation
-		camera_positions = self.camera_list.getCameraCentresXZ(origin)
-		viewing_circle_centre = self.camera_list.getViewingCircleCentre()
-		camera_rig_radius = self.camera_list.getViewingCircleRadius()
-
-		cameraLeftPosition = camera_positions[cameraLeftID]
-		cameraRightPosition = camera_positions[cameraRightID]
-
-		# Find where the two incoming cameras map onto the viewing circle. These form theta_0 and theta_1
-		theta_0 = mapPointToODSAngle(cameraLeftPosition, viewing_circle_centre, ipd, eye)
-		theta_1 = mapPointToODSAngle(cameraRightPosition, viewing_circle_centre, ipd, eye)
-		theta_0_degree = radians2Degrees360(theta_0)
-		theta_1_degree = radians2Degrees360(theta_1)
-
-		if direction is 'left2right':
-			start_col = camLeft.getCOPLeft()
-			end_col = image_width
-			camFirst = camLeft
-			camSecond = camRight
-			imageFirst = imageLeft
-			imageSecond = imageRight
-		elif direction is 'right2left':
-			start_col = 0
-			end_col = camLeft.getCOPLeft()
-			camFirst = camRight
-			camSecond = camLeft
-			imageFirst = imageRight
-			imageSecond = imageLeft
+			xn_new = thetaToNormalizedX(theta_p)
+			# Make sure xn_new is between 0 and 1.
+			xn_new = np.clip(xn_new, 0, 1)
+			ods_columns = np.minimum(unnormalizeX(xn_new, pan_width).astype('int32'), int(pan_width)-1)
+
+			# Forward splat every pixel at once. Where several pixels land on the same output pixel,
+			# the one that comes last in loop order is kept.
+			k_col_ids = col_ids[cols]
+			k_row_ids = row_ids[cols]
+			if self.projection == 'equirectangular':
+				ods_rows = self.getRowLUT(cameraFirstID, ipds[k], pan_height, origin)[k_row_ids, k_col_ids]
+			else:
+				ods_rows = k_row_ids
+			target_index = (ods_rows*int(pan_width) + ods_columns).ravel()
+			source_index = (k_row_ids*image_width + k_col_ids).ravel()
+			keep = self.getLastWriteIndices(target_index)
+			output_image = np.zeros((int(partial_height), int(pan_width), 3), dtype='uint8')
+			output_image.reshape(-1, 3)[target_index[keep]] = imageFirst.reshape(-1, 3)[source_index[keep]]
+			# Nearest neighbour keeps the holes between splatted pixels empty
+			if self.projection == 'linear':
+				output_image = self.scaleRowsToPanaroma(output_image, pan_height, cv2.INTER_NEAREST)
+			output_images.append(output_image)
+
+		return output_images
+
+	def getSweepPairGeometry(self, cameraLeftID, cameraRightID, frameIDLeft, frameIDRight, image_width,
+		direction, origin, ipds, eye):
+		"""
+		IPD dependent geometry of a view interpolation pair, from the compiled rig geometry of every
+		IPD: the column range of the first camera and the ODS angles (theta_0, theta_1, in degrees)
+		of the two cameras.
+		"""
+		rigs = [self.camera_list.compile(ipd, origin) for ipd in ipds]
+		# Where the two incoming cameras map onto the viewing circle. These form theta_0 and theta_1
+		theta_0_degrees = [radians2Degrees360(rig.getODSAngles(eye)[cameraLeftID]) for rig in rigs]
+		theta_1_degrees = [radians2Degrees360(rig.getODSAngles(eye)[cameraRightID]) for rig in rigs]
+		start_cols, end_cols = self.getPairColumnRanges(cameraLeftID, direction, ipds, origin)
+
+		if direction == 'left2right':
+			pair = (cameraLeftID, cameraRightID, frameIDLeft)
+		else:
+			pair = (cameraRightID, cameraLeftID, frameIDRight)
+
+		# The viewing circle centre does not depend on the IPD
+		return pair + (start_cols, end_cols, theta_0_degrees, theta_1_degrees, rigs[0].viewing_circle_centre)
+
+	def getPairColumnRanges(self, cameraLeftID, direction, ipds, origin=[0, 0, 0]):
+		"""
+		Columns [start_col, end_col) of the first image of a view interpolation pair that are
+		interpolated, for every IPD. They do not depend on the eye.
+		"""
+		image_width = int(self.camera_list[cameraLeftID].resolution[0])
+		cop_columns = [int(self.camera_list.compile(ipd, origin).cop_columns_left[cameraLeftID]) for ipd in ipds]
+		if direction == 'left2right':
+			return cop_columns, [image_width]*len(ipds)
+		elif direction == 'right2left':
+			return [0]*len(ipds), cop_columns
 		else:
 			raise RuntimeError('Unsupported view interpolation direction : ', direction)
 
-		# Debug prints
-		# print('start_col: ', start_col, '\tend col: ', end_col)
-		# print('theta_0: ', theta_0_degree, '\ttheta_1: ', theta_1_degree)
-
-		# Optical flow calculator
-		of = OpticalFlowCalculator()
-		flow = of.calculateFlow(imageFirst, imageSecond)
-
-		for col_id in range(start_col, end_col):
-			for row_id in range(0, image_height):
-				ray_first = camFirst.getRayForPixelInGlobalRef(col_id, row_id)
-				ray_first_xz = np.asarray((ray_first[0], ray_first[2]), dtype='float32')
-				theta_a = mapPointToODSAngle(ray_first_xz, viewing_circle_centre, ipd, eye)
-				theta_a_degree = radians2Degrees360(theta_a)
-
-				# Get horizontal flow for the current column
-				ver_flow = flow[row_id, col_id, 0]
-				hor_flow = flow[row_id, col_id, 1]
-				col_id_correspondence = col_id + hor_flow
-				row_id_correspondence = row_id + ver_flow
-				ray_second = camSecond.getRayForPixelInGlobalRef(col_id_correspondence, row_id_correspondence)
-				ray_second_xz = np.asarray((ray_second[0], ray_second[2]), dtype='float32')
-				theta_b = mapPointToODSAngle(ray_second_xz, viewing_circle_centre, ipd, eye)
-				theta_b_degree = radians2Degrees360(theta_b)
-
-				theta_p_degree = self.normalizeThenInterpolate(theta_0_degree, theta_1_degree, theta_a_degree, theta_b_degree, eye)
-				theta_p = degrees3602Radians(theta_p_degree)
-
-				xn_new = thetaToNormalizedX(theta_p)
-				# Make sure xn_new is between 0 and 1.
-				xn_new = np.clip(xn_new, 0, 1)
-				ods_column = int(unnormalizeX(xn_new, pan_width))
-				# print(col_id, theta_a_degree, theta_b_degree, theta_p_degree, ods_column)
-				output_image[row_id, ods_column, :] = imageFirst[row_id, col_id, :]
+	def getPairFlowColumns(self, cameraLeftID, direction, ipds, origin=[0, 0, 0]):
+		"""
+		Columns of the first image for which a view interpolation pair needs flow, including the
+		flow margin. None if flow is computed for the whole image.
+		"""
+		if self.flow_margin is None:
+			return None
+		start_cols, end_cols = self.getPairColumnRanges(cameraLeftID, direction, ipds, origin)
+		return (max(0, min(start_cols) - self.flow_margin), max(end_cols) + self.flow_margin)
+
+	def getLastWriteIndices(self, target_index):
+		"""
+		Given the flat output indices of a sequence of writes, returns the indices of the writes that
+		survive when they are applied in order, i.e. the last write to every output index.
+		"""
+		_, first_in_reversed = np.unique(target_index[::-1], return_index=True)
+		return target_index.shape[0] - 1 - first_in_reversed
+
+	def calculatePairFlow(self, frameIDLeft, frameIDRight, direction='left2right', columns=None):
+		"""
+		Optical flow used by the view interpolaters for a pair of images. For 'left2right' the flow
+		goes from the left to the right image, for 'right2left' the other way around. columns
+		optionally restricts the flow to the columns (start_col, end_col) of the first image, see
+		getPairFlowColumns.
+		"""
+		image_from, image_to = self.getPairImages(frameIDLeft, frameIDRight, direction)
+
+		# Warm started flow depends on the previous frames, so it does not go through the flow cache
+		if self.temporal_flow is not None:
+			return self.temporal_flow.getFlow(image_from, image_to, self.flow_calculator,
+				(frameIDLeft, frameIDRight, direction), columns)
+		return self.flow_cache.getFlow(image_from, image_to, self.flow_calculator, columns)
+
+	def getPairImages(self, frameIDLeft, frameIDRight, direction='left2right'):
+		# (first, second) image of the flow of a pair, see calculatePairFlow
+		imageLeft = self.image_list[frameIDLeft].getImage()
+		imageRight = self.image_list[frameIDRight].getImage()
+		if direction == 'left2right':
+			return imageLeft, imageRight
+		elif direction == 'right2left':
+			return imageRight, imageLeft
+		else:
+			raise RuntimeError('Unsupported view interpolation direction : ', direction)
 
-		return output_image
+	def getJobFlows(self, jobs, ipds, origin, num_workers):
+		"""
+		(flow cache key, cached flow) for every render job. Jobs in worker processes can not use the
+		flow cache of this renderer, so cached flow is looked up here and sent with the job, and flow
+		the job computes is added to the cache afterwards, see addJobFlow. The flow is None if the job
+		has to compute it, the key is None if the job does not run in a worker or the flow is warm
+		started.
+		"""
+		if num_workers is None or num_workers <= 1 or self.temporal_flow is not None:
+			return [(None, None)]*len(jobs)
+		job_flows = []
+		for (cameraLeftID, cameraRightID, direction) in jobs:
+			image_from, image_to = self.getPairImages(cameraLeftID, cameraRightID, direction)
+			key = self.flow_cache.getFlowKey(image_from, image_to, self.flow_calculator,
+				self.getPairFlowColumns(cameraLeftID, direction, ipds, origin))
+			job_flows.append((key, self.flow_cache.lookupFlow(key)))
+		return job_flows
+
+	def addJobFlow(self, job_flow, flow):
+		# Flow computed by a worker goes into the memory tier, the worker already wrote it to disk
+		key, cached_flow = job_flow
+		if key is not None and cached_flow is None and flow is not None:
+			self.flow_cache.addFlow(key, flow, save=False)
 
 	# View interpolation wrapper : default is column wise interpolation
 	def viewInterpolate(self, cameraLeftID, cameraRightID, frameIDLeft, frameIDRight, pan_width, 
-		direction='left2right', origin=[0, 0, 0], ipd=0.062, eye=-1, vi_type='cwise'):
-		if vi_type is 'cwise':
-			interp_image = self.viewInterpolationCwise(cameraLeftID, cameraRightID, frameIDLeft, frameIDRight,
-				pan_width, direction, origin, ipd, eye)
-		elif vi_type is 'pwise':
-			interp_image = self.viewInterpolationPixelwise(cameraLeftID, cameraRightID, frameIDLeft, frameIDRight,
-				pan_width, direction, origin, ipd, eye)
+		direction='left2right', origin=[0, 0, 0], ipd=0.062, eye=-1, vi_type='cwise', flow=None, pan_height=None):
+		return self.viewInterpolateSweep(cameraLeftID, cameraRightID, frameIDLeft, frameIDRight, pan_width,
+			direction, origin, [ipd], eye, vi_type, flow, pan_height)[0]
+
+	def viewInterpolateSweep(self, cameraLeftID, cameraRightID, frameIDLeft, frameIDRight, pan_width,
+		direction='left2right', origin=[0, 0, 0], ipds=[0.062], eye=-1, vi_type='cwise', flow=None, pan_height=None):
+		if vi_type == 'cwise':
+			interp_images = self.viewInterpolationCwiseSweep(cameraLeftID, cameraRightID, frameIDLeft, frameIDRight,
+				pan_width, direction, origin, ipds, eye, flow, pan_height)
+		elif vi_type == 'pwise':
+			interp_images = self.viewInterpolationPixelwiseSweep(cameraLeftID, cameraRightID, frameIDLeft,
+				frameIDRight, pan_width, direction, origin, ipds, eye, flow, pan_height)
 		else:
 			raise RuntimeError('Unknown interpolation type')
 
-		return interp_image
+		return interp_images
 
 
-	def render360WithViewInterpolation(self, ipd, output_image_dim, eye=-1, origin=[0, 0, 0]):
+	def setupCamerasForRendering(self, ipd, origin=[0, 0, 0]):
+		"""
+		Compiles the rig geometry for ipd and makes it the current one. The centre of projection and
+		the ODS position of both eyes are also set on every camera whenever the geometry changes.
+		"""
+		rig = self.camera_list.compile(ipd, origin)
+		if ipd > rig.viewing_circle_radius:
+			raise RuntimeError('IPD cannot be greater than the radius of the camera rig.')
+		if rig is self.rig_geometry:
+			return rig
+
+		for i in range(0, rig.num_cameras):
+			camera = self.camera_list[i]
+			camera.cop_rtheta_left = rig.cop_angles[i]
+			camera.cop_rtheta_right = rig.cop_angles[i]
+			camera.setCOPLeft(rig.cop_columns_left[i])
+			camera.setCOPRight(rig.cop_columns_right[i])
+			camera.setPositionInODSImageLeft(rig.ods_positions_left[i])
+			camera.setPositionInODSImageRight(rig.ods_positions_right[i])
+		self.rig_geometry = rig
+		return rig
+
+	def getCoverageType(self, vi_type):
+		# Column wise interpolation fills whole columns, pixel wise interpolation single pixels.
+		# Equirectangular partials only cover the rows the cameras see.
+		if vi_type == 'pwise' or self.projection == 'equirectangular':
+			return 'pixel'
+		return 'column'
+
+	def getViewInterpolationJobs(self):
+		"""
+		(cameraLeftID, cameraRightID, direction) for every stereo pair and direction, in merge order.
+		"""
+		# Order of the cameras in the rig
+		camera_order = self.camera_order
+		jobs = []
+		for direction in ['left2right', 'right2left']:
+			for cam in range(0, 10, 2):
+				jobs.append((camera_order[cam], camera_order[cam+1], direction))
+		return jobs
+
+	def render360WithViewInterpolation(self, ipd, output_image_dim, eye=-1, origin=[0, 0, 0], vi_type='cwise',
+		num_workers=1, blend='average'):
 		self.sanityCheck()
 		height = output_image_dim[0]
 		width = output_image_dim[1]
-		output_image = np.zeros((height, width, 3), dtype='uint8')
-
-		camera_positions = self.camera_list.getCameraCentresXZ(origin)
-		viewing_circle_centre = self.camera_list.getViewingCircleCentre()
-		rig_radius = self.camera_list.getViewingCircleRadius()
+		compositor = PanaromaCompositor((height, width), coverage=self.getCoverageType(vi_type))
 
-		if ipd > rig_radius:
-			raise RuntimeError('IPD too large')
-
-		nc = self.camera_list.getNumCameras()
-		# Order of the cameras in the rig
-		camera_order = self.camera_order
 		# setup cameras for rendering
-		for i in range(0, nc):
-			theta = getAngle(viewing_circle_centre, camera_positions[i, :], ipd)
-			self.camera_list[i].setCOPRelativeAngleLeft(theta)
-			self.camera_list[i].setCOPRelativeAngleRight(theta)
-
-			xnl = mapPointToODSColumn(camera_positions[i, :], viewing_circle_centre, ipd, -1)
-			xnr = mapPointToODSColumn(camera_positions[i, :], viewing_circle_centre, ipd, 1)
-			self.camera_list[i].setPositionInODSImageLeft(xnl)
-			self.camera_list[i].setPositionInODSImageRight(xnr)
-
-		# View interpolation
-		cam_start = 0
-		cam_end = 10
-		for cam in range(cam_start, cam_end, 2):
-			tempL2R = self.viewInterpolate(camera_order[cam], camera_order[cam+1], 
-				camera_order[cam], camera_order[cam+1], width, direction='left2right',
-				origin=origin, ipd=ipd, eye=eye, vi_type='cwise')
-			output_image = self.updateODSPanaroma(output_image, tempL2R)
-
-		for cam in range(cam_start, cam_end, 2):
-			tempR2L = self.viewInterpolate(camera_order[cam], camera_order[cam+1], 
-				camera_order[cam], camera_order[cam+1], width, direction='right2left',
-				origin=origin, ipd=ipd, eye=eye, vi_type='cwise')
-			output_image = self.updateODSPanaroma(output_image, tempR2L)
-
-		return output_image
-
+		self.setupCamerasForRendering(ipd, origin)
+
+		# View interpolation. Every pair and direction is an independent job, so the jobs can be
+		# rendered in parallel. Results are merged in job order, so the output does not depend on
+		# the number of workers.
+		jobs = self.getViewInterpolationJobs()
+		job_flows = self.getJobFlows(jobs, [ipd], origin, num_workers)
+		job_args = [job + (width, origin, ipd, eye, vi_type, height, self.getPairFlowState(job), job_flow[1])
+			for (job, job_flow) in zip(jobs, job_flows)]
+		partial_images = self.runRenderJobs(renderViewInterpolationJob, job_args, num_workers, jobs)
+		for (job, job_flow, (temp_image, flow_state, flow)) in zip(jobs, job_flows, partial_images):
+			self.setPairFlowState(job, flow_state)
+			self.addJobFlow(job_flow, flow)
+			compositor.addImage(temp_image, self.getJobBlendWeights(job, width, eye, blend))
+
+		return compositor.getPanaroma()
+
+	def renderStereo360(self, ipd, output_image_dim, origin=[0, 0, 0], vi_type='cwise', num_workers=1,
+		packed=False, out=None, blend='average'):
+		"""
+		Renders the panaromas for both eyes in one pass. Camera setup and the optical flow of every
+		pair are computed once and shared by the two eyes.
+		Returns (left, right), or with packed=True a single (2*height, width, 3) image with the left
+		eye on top and the right eye at the bottom. out can be a preallocated buffer for the packed
+		image.
+		"""
+		self.sanityCheck()
+		height = output_image_dim[0]
+		width = output_image_dim[1]
+		if out is None:
+			out = np.zeros((2*height, width, 3), dtype='uint8')
+		elif out.shape != (2*height, width, 3):
+			raise RuntimeError('Output buffer must have shape (2*height, width, 3)')
+		left_image = out[0:height]
+		right_image = out[height:2*height]
+
+		self.setupCamerasForRendering(ipd, origin)
+		compositor_left = PanaromaCompositor((height, width), coverage=self.getCoverageType(vi_type))
+		compositor_right = PanaromaCompositor((height, width), coverage=self.getCoverageType(vi_type))
+
+		jobs = self.getViewInterpolationJobs()
+		job_flows = self.getJobFlows(jobs, (ipd,), origin, num_workers)
+		job_args = [job + (width, origin, (ipd,), vi_type, height, self.getPairFlowState(job), job_flow[1])
+			for (job, job_flow) in zip(jobs, job_flows)]
+		partial_images = self.runRenderJobs(renderStereoViewInterpolationJob, job_args, num_workers, jobs)
+		for (job, job_flow, (temp_left, temp_right, flow_state, flow)) in zip(jobs, job_flows, partial_images):
+			self.setPairFlowState(job, flow_state)
+			self.addJobFlow(job_flow, flow)
+			compositor_left.addImage(temp_left[0], self.getJobBlendWeights(job, width, -1, blend))
+			compositor_right.addImage(temp_right[0], self.getJobBlendWeights(job, width, 1, blend))
+		compositor_left.getPanaroma(out=left_image)
+		compositor_right.getPanaroma(out=right_image)
+
+		if packed:
+			return out
+		return left_image, right_image
+
+	def renderStereo360Sweep(self, ipds, output_image_dim, origin=[0, 0, 0], vi_type='cwise', num_workers=1,
+		blend='average'):
+		"""
+		Renders the stereo panaromas of the current frame for every IPD in ipds, e.g. to tune stereo
+		comfort. Optical flow, rays and the projections of the rays onto the xz plane do not depend on
+		the IPD, so they are computed once per pair and shared by all IPDs and both eyes.
+		Returns a list with a (left, right) pair for every IPD, in the order of ipds.
+		"""
+		self.sanityCheck()
+		height = output_image_dim[0]
+		width = output_image_dim[1]
+		rigs = [self.setupCamerasForRendering(ipd, origin) for ipd in ipds]
+		coverage = self.getCoverageType(vi_type)
+		compositors_left = [PanaromaCompositor((height, width), coverage=coverage) for ipd in ipds]
+		compositors_right = [PanaromaCompositor((height, width), coverage=coverage) for ipd in ipds]
+
+		jobs = self.getViewInterpolationJobs()
+		job_flows = self.getJobFlows(jobs, tuple(ipds), origin, num_workers)
+		job_args = [job + (width, origin, tuple(ipds), vi_type, height, self.getPairFlowState(job), job_flow[1])
+			for (job, job_flow) in zip(jobs, job_flows)]
+		partial_images = self.runRenderJobs(renderStereoViewInterpolationJob, job_args, num_workers, jobs)
+		for (job, job_flow, (temp_left, temp_right, flow_state, flow)) in zip(jobs, job_flows, partial_images):
+			self.setPairFlowState(job, flow_state)
+			self.addJobFlow(job_flow, flow)
+			for k in range(len(ipds)):
+				compositors_left[k].addImage(temp_left[k], self.getJobBlendWeights(job, width, -1, blend, rigs[k]))
+				compositors_right[k].addImage(temp_right[k], self.getJobBlendWeights(job, width, 1, blend, rigs[k]))
+
+		return [(compositors_left[k].getPanaroma(), compositors_right[k].getPanaroma()) for k in range(len(ipds))]
+
+	def runRenderJobs(self, job_function, job_args, num_workers=1, job_frames=None):
+		"""
+		Calls job_function(renderer, args) for every entry in job_args and yields the results in the
+		same order as job_args. With more than one worker, the jobs run in a process pool (see
+		getWorkerPool) and job_frames lists the frame IDs of the images every job needs, which are
+		sent with the job.
+		Results are yielded one at a time, so callers can merge and drop each partial render instead
+		of holding all of them.
+		"""
+		if num_workers is None or num_workers <= 1:
+			for args in job_args:
+				yield job_function(self, args)
+			return
+
+		pool = self.getWorkerPool(num_workers)
+		jobs = []
+		for (args, frames) in zip(job_args, job_frames):
+			images = dict([(frame_id, self.image_list[frame_id].getImage()) for frame_id in frames[0:2]])
+			jobs.append((job_function, args, images))
+		for result in pool.map(runJobInRenderWorker, jobs):
+			yield result
+
+	def getWorkerStateDict(self):
+		# Renderer state for worker processes. Images are left out, jobs bring their own. Rays, rig
+		# geometry and lookup tables are dropped by the __getstate__ of their owners and rebuilt in
+		# the worker when needed.
+		state = self.__getstate__()
+		state['image_list'] = None
+		state['rig_geometry'] = None
+		state['lut_state_hash'] = None
+		return state
+
+	def getWorkerState(self):
+		# Pickled copy of the renderer for worker processes
+		return pickle.dumps(self.getWorkerStateDict(), pickle.HIGHEST_PROTOCOL)
+
+	def getWorkerStateHash(self):
+		"""
+		Identifies what the workers render with: the camera state (calibration and in memory changes)
+		and the settings of the renderer. Cameras are represented by getCameraStateHash, so per IPD
+		values set on them by setupCamerasForRendering do not count.
+		"""
+		state = self.getWorkerStateDict()
+		state['camera_list'] = self.camera_list.getCameraStateHash()
+		return hashlib.sha1(pickle.dumps(state, pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+	def getWorkerPool(self, num_workers):
+		"""
+		Process pool for render jobs. The pool is kept between render calls and only started again
+		when the number of workers, the cameras or the settings of the renderer changed, see
+		getWorkerStateHash.
+		"""
+		state_hash = self.getWorkerStateHash()
+		if self.worker_pool is not None and (self.worker_pool_size != num_workers or
+			self.worker_state_hash != state_hash):
+			self.closeWorkerPool()
+		if self.worker_pool is None:
+			self.worker_pool = ProcessPoolExecutor(max_workers=num_workers, initializer=initializeRenderWorker,
+				initargs=(self.getWorkerState(),))
+			self.worker_pool_size = num_workers
+			self.worker_state_hash = state_hash
+		return self.worker_pool
+
+	def closeWorkerPool(self):
+		# Stops the worker processes, they are started again by the next parallel render
+		if self.worker_pool is not None:
+			self.worker_pool.shutdown()
+			self.worker_pool = None
+			self.worker_pool_size = 0
+			self.worker_state_hash = None
 
 	def visualizeProjectionCentres(self, output_image_dim):
 		self.sanityCheck()
@@ -497,7 +1028,60 @@ class RendererODS():
 		return output_image
 
 
-
-
-
-
+# Render jobs. These are module level functions so that they can be sent to worker processes.
+
+# Copy of the renderer owned by a worker process
+worker_renderer = None
+
+class JobImage:
+	# Image sent to a worker process with a render job, stands in for the SJPImage of the frame
+	def __init__(self, image):
+		self.image = image
+
+	def getImage(self):
+		return self.image
+
+def initializeRenderWorker(state):
+	global worker_renderer
+	worker_renderer = RendererODS.__new__(RendererODS)
+	worker_renderer.__dict__.update(pickle.loads(state))
+	# One OpenCV thread per worker, parallelism comes from the processes
+	cv2.setNumThreads(1)
+
+def runJobInRenderWorker(job):
+	job_function, args, images = job
+	worker_renderer.image_list = dict([(frame_id, JobImage(image)) for (frame_id, image) in images.items()])
+	return job_function(worker_renderer, args)
+
+# Workers do not share state with the renderer that runs the jobs. Jobs get the temporal flow state
+# and the cached flow of their pair (None if not cached) and return the updated state, plus the flow
+# if they computed it, see RendererODS.getJobFlows.
+
+def getJobFlow(renderer, cameraLeftID, cameraRightID, direction, ipds, origin, cached_flow):
+	if cached_flow is not None:
+		return cached_flow
+	return renderer.calculatePairFlow(cameraLeftID, cameraRightID, direction,
+		renderer.getPairFlowColumns(cameraLeftID, direction, ipds, origin))
+
+def renderViewInterpolationJob(renderer, args):
+	(cameraLeftID, cameraRightID, direction, pan_width, origin, ipd, eye, vi_type, pan_height, flow_state,
+		cached_flow) = args
+	pair = (cameraLeftID, cameraRightID, direction)
+	renderer.setPairFlowState(pair, flow_state)
+	flow = getJobFlow(renderer, cameraLeftID, cameraRightID, direction, [ipd], origin, cached_flow)
+	interp_image = renderer.viewInterpolate(cameraLeftID, cameraRightID, cameraLeftID, cameraRightID, pan_width,
+		direction=direction, origin=origin, ipd=ipd, eye=eye, vi_type=vi_type, flow=flow, pan_height=pan_height)
+	return interp_image, renderer.getPairFlowState(pair), None if cached_flow is not None else flow
+
+def renderStereoViewInterpolationJob(renderer, args):
+	(cameraLeftID, cameraRightID, direction, pan_width, origin, ipds, vi_type, pan_height, flow_state,
+		cached_flow) = args
+	pair = (cameraLeftID, cameraRightID, direction)
+	renderer.setPairFlowState(pair, flow_state)
+	# Flow is shared by both eyes and all IPDs. Returns a list of partial images per eye.
+	flow = getJobFlow(renderer, cameraLeftID, cameraRightID, direction, ipds, origin, cached_flow)
+	interp_left = renderer.viewInterpolateSweep(cameraLeftID, cameraRightID, cameraLeftID, cameraRightID, pan_width,
+		direction=direction, origin=origin, ipds=ipds, eye=-1, vi_type=vi_type, flow=flow, pan_height=pan_height)
+	interp_right = renderer.viewInterpolateSweep(cameraLeftID, cameraRightID, cameraLeftID, cameraRightID, pan_width,
+		direction=direction, origin=origin, ipds=ipds, eye=1, vi_type=vi_type, flow=flow, pan_height=pan_height)
+	return interp_left, interp_right, renderer.getPairFlowState(pair), None if cached_flow is not None else flow
@@ -41,10 +41,10 @@ def test_ODS_renderer():
 	camera_order = [0, 1, 2, 3, 8, 9, 6, 7, 4, 5, 0]
 	rods.setCameraOrder(camera_order)
 
-	pan_for_eye = rods.render360WithViewInterpolation(0.062, [480, 2000], eye=-1)
-	pyplt.subplot(211), pyplt.imshow(pan_for_eye), pyplt.axis('off'), pyplt.title('360 - Left eye')
-	pan_for_eye = rods.render360WithViewInterpolation(0.062, [480, 2000], eye=1)
-	pyplt.subplot(212), pyplt.imshow(pan_for_eye), pyplt.axis('off'), pyplt.title('360 - Right eye')
+	# Both eyes in one pass, camera setup and optical flow are shared
+	(pan_left, pan_right) = rods.renderStereo360(0.062, [480, 2000])
+	pyplt.subplot(211), pyplt.imshow(pan_left), pyplt.axis('off'), pyplt.title('360 - Left eye')
+	pyplt.subplot(212), pyplt.imshow(pan_right), pyplt.axis('off'), pyplt.title('360 - Right eye')
 
 	# This function goes over every camera in the list and plots image planes in the global frame. 
 	# These points are also mapped onto the viewing circle.
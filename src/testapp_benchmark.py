@@ -0,0 +1,411 @@
+from renderer import *
+from cameras import *
+from SJPImage import *
+from ExposureCorrect import *
+import argparse
+import json
+import platform
+import sys
+import time
+
+
+# Benchmark harness for the stages of the ODS pipeline.
+# Inputs are reproducible: the rig comes from the calibration file and the images are synthetic
+# (seeded) unless a data.yaml frame is given. Results are written as JSON and can be compared
+# against an earlier run to flag regressions.
+
+def arg_setup():
+	ap = argparse.ArgumentParser()
+	ap.add_argument("-s", "--second", default='../test_data/calibration.yaml', help="path to calibration file")
+	ap.add_argument("-f", "--first", required=False, help="optional data.yaml, frame0 is used instead of synthetic images")
+	ap.add_argument("-o", "--output", default='benchmark.json', help="path to write the JSON results to")
+	ap.add_argument("-c", "--compare", required=False, help="earlier JSON results to compare against")
+	ap.add_argument("-t", "--threshold", type=float, default=0.2, help="relative slow down reported as a regression")
+	ap.add_argument("-r", "--repeats", type=int, default=3, help="number of timed runs per stage")
+	ap.add_argument("--scales", default='0.5,1.0', help="comma separated camera resolution scales")
+	ap.add_argument("--widths", default='1000,2000,4000', help="comma separated panaroma widths")
+	ap.add_argument("--stages", default='all', help="comma separated stage groups to run, or 'all'")
+	args = vars(ap.parse_args())
+	return args
+
+
+def timeStage(results, name, function, repeats, params=None):
+	"""
+	Runs function repeats times and stores the best and median wall clock time under name.
+	Stages that cannot run (e.g. missing OpenCV modules) are recorded as skipped.
+	"""
+	times = []
+	try:
+		for i in range(repeats):
+			start = time.time()
+			function()
+			times.append(time.time() - start)
+	except (AttributeError, cv2.error) as e:
+		print('skipping ', name, ': ', e)
+		results[name] = {'skipped': str(e), 'params': params}
+		return
+	results[name] = {'best': min(times), 'median': float(np.median(times)), 'repeats': repeats, 'params': params}
+	print(name, '\t', 'best: ', '%.4f' % min(times), 's')
+
+
+def makeSyntheticImages(num_cameras, width, height, seed=0):
+	"""
+	Smooth random texture, every camera sees a horizontally shifted crop of it so that optical flow
+	and feature matching have something to find.
+	"""
+	rng = np.random.RandomState(seed)
+	margin = width//4
+	texture = rng.randint(0, 256, (max(1, height//8), max(1, (width + margin)//8), 3)).astype('uint8')
+	texture = cv2.resize(texture, (width + margin, height), interpolation=cv2.INTER_CUBIC)
+	images = []
+	for i in range(num_cameras):
+		offset = (i*17) % margin
+		images.append(np.ascontiguousarray(texture[:, offset:offset+width]))
+	return images
+
+
+def makeFlowPair(width, height, seed=0, min_shift=0.01, max_shift=0.04):
+	"""
+	Image pair with known optical flow. The first image is a texture with detail at several scales,
+	the second is the same texture moved right by a displacement that grows linearly across the image
+	from min_shift to max_shift (fractions of the width), like the parallax between neighbouring
+	cameras. Returns (first, second, ground truth flow, mask of the pixels the flow is checked on).
+	"""
+	rng = np.random.RandomState(seed)
+	texture = np.zeros((height, width, 3), dtype='float32')
+	for cell in [4, 8, 16, 32, 64]:
+		noise = rng.uniform(-1, 1, (height//cell + 2, width//cell + 2, 3)).astype('float32')
+		texture += cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)
+	first = np.clip(128 + 40*texture, 0, 255).astype('uint8')
+
+	# second(x) = first(x - a - b*x), so the pixel x of the first image moves to (x + a)/(1 - b)
+	a = min_shift*width
+	b = float(max_shift - min_shift)
+	x, y = np.meshgrid(np.arange(width, dtype='float32'), np.arange(height, dtype='float32'))
+	second = cv2.remap(first, x - a - b*x, y, cv2.INTER_CUBIC, borderMode=cv2.BORDER_REFLECT)
+	flow = np.zeros((height, width, 2), dtype='float32')
+	flow[:, :, 0] = (a + b*x)/(1 - b)
+
+	# Pixels near the border have no (or a reflected) correspondence
+	border = 16
+	mask = np.zeros((height, width), dtype='bool')
+	mask[border:height-border, border:width-border-int(np.ceil(max_shift*width))] = True
+	return first, second, flow, mask
+
+
+def loadCameras(calib_file, scale=1.0):
+	"""
+	Camera collection from the calibration file, with the intrinsics and resolution scaled by scale.
+	"""
+	cc = CameraCollection()
+	cc.readAllCameras(calib_file)
+	for i in range(cc.getNumCameras()):
+		cam = cc[i]
+		cam.resolution = np.rint(cam.resolution*scale).astype('int32')
+		cam.intrinsics[0:2, :] = cam.intrinsics[0:2, :]*scale
+		cam.intrinsics_inverse = np.linalg.inv(cam.intrinsics)
+		cam.fx = cam.fx*scale
+		cam.fy = cam.fy*scale
+		cam.favg = cam.favg*scale
+	cc.getCameraCentresXZ([0, 0, 0])
+	return cc
+
+
+def makeRenderer(cc, images):
+	ic = SJPImageCollection()
+	for image in images:
+		ic.addImageToCollection(SJPImage(image=image, resize=False))
+	rods = RendererODS()
+	rods.setImageList(ic)
+	rods.setCameraList(cc)
+	rods.setCameraOrder([0, 1, 2, 3, 8, 9, 6, 7, 4, 5, 0])
+	return rods
+
+
+def benchmarkGeometry(results, cc, repeats, tag):
+	cam = cc[1]
+	width = int(cam.resolution[0])
+	centre = cc.getViewingCircleCentre()
+	cols = np.arange(width)
+
+	def raysScalar():
+		for col in range(width):
+			cam.getRayForPixelInGlobalRef(col, 0)
+	timeStage(results, 'geometry/getRayForPixelInGlobalRef/' + tag, raysScalar, repeats, {'calls': width})
+	timeStage(results, 'geometry/getRaysForPixelsInGlobalRef/' + tag,
+		lambda: cam.getRaysForPixelsInGlobalRef(cols, np.zeros(width)), repeats, {'pixels': width})
+
+	points = cam.getRaysForPixelsInGlobalRef(cols, np.zeros(width))[:, [0, 2]]
+	def anglesScalar():
+		for p in points:
+			mapPointToODSAngle(p, centre, 0.062, -1)
+	timeStage(results, 'geometry/mapPointToODSAngle/' + tag, anglesScalar, repeats, {'calls': width})
+	timeStage(results, 'geometry/mapPointToODSAngleArray/' + tag,
+		lambda: mapPointToODSAngleArray(points, centre, 0.062, -1), repeats, {'points': width})
+
+
+def benchmarkFlow(results, images, repeats, tag):
+	of = OpticalFlowCalculator()
+	timeStage(results, 'flow/calculateFlow/' + tag, lambda: of.calculateFlow(images[0], images[1]), repeats,
+		{'shape': list(images[0].shape)})
+
+
+def benchmarkFlowBackends(results, width, height, repeats, tag, num_pairs=5):
+	"""
+	Time of every flow backend on image pairs with known flow (see makeFlowPair), and the mean
+	endpoint error of its flow w.r.t. the ground truth.
+	"""
+	flow_pairs = [makeFlowPair(width, height, seed) for seed in range(num_pairs)]
+	pairs = [(first, second) for (first, second, flow, mask) in flow_pairs]
+
+	for name in sorted(flow_backends):
+		name_tag = 'flow/backend/' + name + '/' + tag
+		try:
+			calculator = createOpticalFlowCalculator(name)
+		except RuntimeError as e:
+			print('skipping ', name_tag, ': ', e)
+			results[name_tag] = {'skipped': str(e), 'params': None}
+			continue
+		timeStage(results, name_tag, lambda: [calculator.calculateFlow(first, second) for (first, second) in pairs],
+			repeats, {'pairs': len(pairs)})
+		if 'best' in results[name_tag]:
+			errors = [getEndpointError(calculator.calculateFlow(first, second), flow, mask)
+				for (first, second, flow, mask) in flow_pairs]
+			results[name_tag]['endpoint_error'] = float(np.mean(errors))
+			print(name_tag, '\t', 'endpoint error: ', '%.3f' % np.mean(errors), 'px')
+
+
+def benchmarkFlowPyramid(results, width, height, repeats, tag):
+	"""
+	Accuracy / speed curve of the Farneback flow computed at every pyramid level, with and without
+	the refinement pass. Endpoint errors are w.r.t. the ground truth flow of makeFlowPair.
+	"""
+	(first, second, flow, mask) = makeFlowPair(width, height)
+	for refine in [False, True]:
+		for level in [0, 1, 2, 3]:
+			calculator = OpticalFlowCalculator()
+			calculator.setPyramidLevel(level, refine)
+			name = 'flow/pyramid/level' + str(level) + ('_refined' if refine else '') + '/' + tag
+			timeStage(results, name, lambda: calculator.calculateFlow(first, second), repeats,
+				{'level': level, 'refine': refine})
+			error = getEndpointError(calculator.calculateFlow(first, second), flow, mask)
+			results[name]['endpoint_error'] = error
+			print(name, '\t', 'endpoint error: ', '%.3f' % error, 'px')
+
+
+def benchmarkStitcher(results, images, repeats, tag):
+	st = Stitcher()
+	timeStage(results, 'stitcher/detectAndDescribe/' + tag, lambda: st.detectAndDescribe(images[0]), repeats)
+	try:
+		(kp1, feat1) = st.detectAndDescribe(images[0])
+		(kp2, feat2) = st.detectAndDescribe(images[1])
+	except (AttributeError, cv2.error) as e:
+		results['stitcher/matchKeyPoints/' + tag] = {'skipped': str(e), 'params': None}
+		return
+	timeStage(results, 'stitcher/matchKeyPoints/' + tag,
+		lambda: st.matchKeyPoints(kp1, kp2, feat1, feat2, 0.7, 5.0), repeats, {'keypoints': [len(kp1), len(kp2)]})
+
+
+def benchmarkFeatureBackends(results, rods, repeats, tag):
+	"""
+	Detection and matching time of every feature backend on the overlapping camera pairs of the rig,
+	and the number of homography inliers per pair.
+	"""
+	pairs = []
+	for (cameraLeftID, cameraRightID, direction) in rods.getViewInterpolationJobs():
+		if direction == 'left2right':
+			pairs.append((rods.image_list[cameraLeftID].getImage(), rods.image_list[cameraRightID].getImage()))
+
+	for name in sorted(feature_backends):
+		st = Stitcher(name)
+		name_tag = 'stitcher/backend/' + name + '/' + tag
+		timeStage(results, name_tag, lambda: [st.getKeyPointMatches(first, second) for (first, second) in pairs],
+			repeats, {'pairs': len(pairs)})
+		if 'best' in results[name_tag]:
+			inliers = []
+			for (first, second) in pairs:
+				M = st.getKeyPointMatches(first, second)
+				inliers.append(0 if M is None else int(np.sum(M[2])))
+			results[name_tag]['inliers'] = inliers
+			print(name_tag, '\t', 'mean inliers: ', '%.1f' % np.mean(inliers))
+
+
+def benchmarkMatchers(results, images, repeats, tag):
+	"""
+	Matching time of the brute force and FLANN matchers (index built beforehand, as it is reused per
+	image) with every homography estimator, and the number of inliers.
+	"""
+	for feature_type in ['orb', 'sift']:
+		try:
+			(kp1, feat1) = Stitcher(feature_type).detectAndDescribe(images[0])
+			(kp2, feat2) = Stitcher(feature_type).detectAndDescribe(images[1])
+		except (AttributeError, cv2.error) as e:
+			results['stitcher/matcher/' + feature_type + '/' + tag] = {'skipped': str(e), 'params': None}
+			continue
+		for matcher_type in ['bruteforce', 'flann']:
+			for estimator in sorted(homography_estimators):
+				name = 'stitcher/matcher/' + feature_type + '/' + matcher_type + '/' + estimator + '/' + tag
+				try:
+					st = Stitcher(feature_type, matcher_type, estimator)
+				except RuntimeError as e:
+					results[name] = {'skipped': str(e), 'params': None}
+					continue
+				index2 = st.createMatcherIndex(feat2)
+				timeStage(results, name, lambda: st.matchKeyPoints(kp1, kp2, feat1, feat2, 0.7, 5.0, index2), repeats,
+					{'keypoints': [len(kp1), len(kp2)]})
+				M = st.matchKeyPoints(kp1, kp2, feat1, feat2, 0.7, 5.0, index2)
+				results[name]['inliers'] = 0 if M is None else int(np.sum(M[2]))
+
+
+def benchmarkRingMatching(results, rods, repeats, tag):
+	"""
+	Matching of all neighbouring pairs of the rig on one thread and on one thread per pair, features
+	included.
+	"""
+	image_list = rods.image_list
+	neighbour_order = rods.camera_order[0:-1]
+	image_list.setStitcher(Stitcher('orb', 'flann'))
+
+	for num_threads in [1, None]:
+		def matchRing():
+			for i in range(len(image_list)):
+				image_list[i].invalidateFeatures()
+			image_list.matchRing(neighbour_order, num_threads)
+		threads_tag = 'serial' if num_threads == 1 else 'threaded'
+		timeStage(results, 'stitcher/matchRing/' + threads_tag + '/' + tag, matchRing, repeats,
+			{'pairs': len(neighbour_order)})
+
+
+def benchmarkExposure(results, repeats):
+	rng = np.random.RandomState(0)
+	intensities = rng.uniform(80, 160, (10, 2))
+
+	def calculateGains():
+		oe = OptimizeExposure()
+		oe.addImageIntensityPairs(intensities)
+		oe.calculateGains()
+	timeStage(results, 'exposure/calculateGains', calculateGains, repeats, {'images': 10})
+
+
+def benchmarkCompositing(results, rods, height, pan_width, repeats, tag):
+	rng = np.random.RandomState(0)
+	partials = []
+	for i in range(10):
+		partial = np.zeros((height, pan_width, 3), dtype='uint8')
+		# Every partial covers a fifth of the panaroma, neighbours overlap by half
+		cols = ((i*pan_width)//10 + np.arange(pan_width//5)) % pan_width
+		partial[:, cols, :] = rng.randint(1, 256, (height, pan_width//5, 3))
+		partials.append(partial)
+
+	def update():
+		panaroma = np.zeros((height, pan_width, 3), dtype='uint8')
+		for partial in partials:
+			panaroma = rods.updateODSPanaroma(panaroma, partial)
+	timeStage(results, 'compositing/updateODSPanaroma/' + tag, update, repeats, {'merges': 10})
+
+	def composite():
+		compositor = PanaromaCompositor((height, pan_width))
+		for partial in partials:
+			compositor.addImage(partial)
+		compositor.getPanaroma()
+	timeStage(results, 'compositing/PanaromaCompositor/' + tag, composite, repeats, {'merges': 10})
+
+
+def benchmarkRenderers(results, rods, height, pan_width, repeats, tag):
+	dim = [height, pan_width]
+	timeStage(results, 'render/render360NoInterpolation/' + tag,
+		lambda: rods.render360NoInterpolation(0.062, dim, eye=-1), repeats)
+	timeStage(results, 'render/render360InverseMapping/' + tag,
+		lambda: rods.render360InverseMapping(0.062, dim, eye=-1), repeats)
+	timeStage(results, 'render/render360WithViewInterpolation_cwise/' + tag,
+		lambda: rods.render360WithViewInterpolation(0.062, dim, eye=-1, vi_type='cwise'), repeats)
+	timeStage(results, 'render/render360WithViewInterpolation_pwise/' + tag,
+		lambda: rods.render360WithViewInterpolation(0.062, dim, eye=-1, vi_type='pwise'), repeats)
+	timeStage(results, 'render/renderStereo360/' + tag,
+		lambda: rods.renderStereo360(0.062, dim), repeats)
+
+
+def compareResults(results, baseline, threshold):
+	"""
+	Returns the stages that got slower than threshold (relative) compared to the baseline run.
+	"""
+	regressions = []
+	for name in sorted(results):
+		if name not in baseline or 'best' not in results[name] or 'best' not in baseline[name]:
+			continue
+		old = baseline[name]['best']
+		new = results[name]['best']
+		if old > 0 and (new - old)/old > threshold:
+			regressions.append((name, old, new))
+	return regressions
+
+
+def run_benchmarks():
+	args = arg_setup()
+	stages = args["stages"].split(',')
+	scales = [float(s) for s in args["scales"].split(',')]
+	widths = [int(w) for w in args["widths"].split(',')]
+	repeats = args["repeats"]
+	results = {}
+
+	def enabled(stage):
+		return 'all' in stages or stage in stages
+
+	if enabled('exposure'):
+		benchmarkExposure(results, repeats)
+
+	for scale in scales:
+		cc = loadCameras(args["second"], scale)
+		height = int(cc[0].resolution[1])
+		width = int(cc[0].resolution[0])
+		if args["first"] is not None:
+			ic = SJPImageCollection()
+			ic.loadImagesFromYAML(args["first"], 'frame0', initialize=False)
+			images = [cv2.resize(ic[i].getImage(), (width, height)) for i in range(len(ic))]
+		else:
+			images = makeSyntheticImages(cc.getNumCameras(), width, height)
+		rods = makeRenderer(cc, images)
+		cam_tag = str(width) + 'x' + str(height)
+
+		if enabled('geometry'):
+			benchmarkGeometry(results, cc, repeats, cam_tag)
+		if enabled('flow'):
+			benchmarkFlow(results, images, repeats, cam_tag)
+			benchmarkFlowBackends(results, width, height, repeats, cam_tag)
+			benchmarkFlowPyramid(results, width, height, repeats, cam_tag)
+		if enabled('stitcher'):
+			benchmarkStitcher(results, images, repeats, cam_tag)
+			benchmarkFeatureBackends(results, rods, repeats, cam_tag)
+			benchmarkMatchers(results, images, repeats, cam_tag)
+			benchmarkRingMatching(results, rods, repeats, cam_tag)
+		for pan_width in widths:
+			tag = cam_tag + '/' + str(pan_width)
+			if enabled('compositing'):
+				benchmarkCompositing(results, rods, height, pan_width, repeats, tag)
+			if enabled('render'):
+				benchmarkRenderers(results, rods, height, pan_width, repeats, tag)
+
+	meta = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': sys.version.split()[0],
+		'numpy': np.__version__, 'opencv': cv2.__version__, 'platform': platform.platform(),
+		'synthetic_images': args["first"] is None, 'repeats': repeats}
+	with open(args["output"], 'w') as stream:
+		json.dump({'meta': meta, 'results': results}, stream, indent=2, sort_keys=True)
+	print('results written to ', args["output"])
+
+	if args["compare"] is not None:
+		with open(args["compare"], 'r') as stream:
+			baseline = json.load(stream)['results']
+		regressions = compareResults(results, baseline, args["threshold"])
+		for (name, old, new) in regressions:
+			print('REGRESSION ', name, ': ', '%.4f' % old, 's -> ', '%.4f' % new, 's')
+		if len(regressions) > 0:
+			sys.exit(1)
+		print('no regressions compared to ', args["compare"])
+
+
+def main():
+	run_benchmarks()
+
+
+if __name__ == '__main__':
+	main()
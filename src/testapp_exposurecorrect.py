@@ -166,9 +166,9 @@ def test_exposure_correct():
 	sim2 = SJPImage(image2)
 	sim3 = SJPImage(image3)
 	stitcher = Stitcher()
-	sim1.setKeypoints(stitcher.getKeyPoints(sim1.getImage()))
-	sim2.setKeypoints(stitcher.getKeyPoints(sim2.getImage()))
-	sim3.setKeypoints(stitcher.getKeyPoints(sim3.getImage()))
+	sim1.setKeypoints(sim1.getFeatures(stitcher)[0])
+	sim2.setKeypoints(sim2.getFeatures(stitcher)[0])
+	sim3.setKeypoints(sim3.getFeatures(stitcher)[0])
 
 	sim1.updateOverlappingRegions(None, sim2)
 	sim2.updateOverlappingRegions(sim1, sim3)
@@ -203,8 +203,8 @@ def test_optical_flow():
 	print('Reading images and detecting keypoints')
 	sim1 = SJPImage(image1)
 	sim2 = SJPImage(image2)
-	sim1.setKeypoints(stitcher.getKeyPoints(sim1.getImage()))
-	sim2.setKeypoints(stitcher.getKeyPoints(sim2.getImage()))
+	sim1.setKeypoints(sim1.getFeatures(stitcher)[0])
+	sim2.setKeypoints(sim2.getFeatures(stitcher)[0])
 
 	# Calculate Optical flow
 	of_cal = OpticalFlowCalculator()
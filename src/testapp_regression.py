@@ -0,0 +1,277 @@
+from renderer import *
+from cameras import *
+from SJPImage import *
+import argparse
+import sys
+
+# Regression checks on the sample rig. Every test raises a RuntimeError if the result is off.
+
+
+def arg_setup():
+	ap = argparse.ArgumentParser()
+	ap.add_argument("-s", "--second", default='../test_data/calibration.yaml', help="path to calibration file")
+	args = vars(ap.parse_args())
+	return args
+
+
+def loadCameras(calib_file):
+	cc = CameraCollection()
+	cc.readAllCameras(calib_file)
+	return cc
+
+
+def test_undistortedRayBundle(calib_file):
+	# Full image grids have more points than cv2.remap accepts in one row
+	cc = loadCameras(calib_file)
+	cc.setUndistortRays(True)
+	camera = cc[0]
+	width = int(camera.resolution[0])
+	height = int(camera.resolution[1])
+	rays = camera.getRaysForPixelsInLocalRef(np.arange(width)[np.newaxis, :], np.arange(height)[:, np.newaxis])
+	cols, rows = np.meshgrid(np.arange(width), np.arange(height))
+	expected = camera.undistortPoints(np.stack((cols.ravel(), rows.ravel()), axis=-1)).reshape(height, width, 2)
+	error = np.abs(rays[:, :, 0:2] - expected).max()
+	if error > 1e-5:
+		raise RuntimeError('Undistorted rays differ from cv2.undistortPoints by ', error)
+	if camera.getRayBundle().shape != (height, width, 3):
+		raise RuntimeError('Ray bundle has the wrong shape')
+	print('test_undistortedRayBundle passed, max error ', error)
+
+
+def setupRenderer(calib_file, width=752, height=480):
+	# Sample rig with smooth synthetic images, every camera sees a shifted crop of the same texture
+	rng = np.random.RandomState(0)
+	texture = rng.randint(0, 255, (height // 8, (width + 200) // 8, 3)).astype('uint8')
+	texture = cv2.resize(texture, (width + 200, height), interpolation=cv2.INTER_CUBIC)
+	image_list = SJPImageCollection()
+	for i in range(10):
+		offset = (i * 17) % 200
+		image_list.addImageToCollection(SJPImage(image=np.ascontiguousarray(texture[:, offset:offset + width]), resize=False))
+	renderer = RendererODS()
+	renderer.setCameraList(loadCameras(calib_file))
+	renderer.setCameraOrder([0, 1, 2, 3, 8, 9, 6, 7, 4, 5, 0])
+	renderer.setImageList(image_list)
+	return renderer
+
+
+def referenceNoInterpolation(renderer, ipd, out_image_dim, eye=1, origin=[0, 0, 0]):
+	# Per column loop of the original render360NoInterpolation
+	rig = renderer.setupCamerasForRendering(ipd, origin)
+	pan_width = out_image_dim[1]
+	output_image = np.zeros((out_image_dim[0], pan_width, 3), dtype='uint8')
+	for i in range(0, renderer.camera_list.getNumCameras()):
+		camera = renderer.camera_list[i]
+		temp_image = np.zeros((out_image_dim[0], pan_width, 3), dtype='uint8')
+		for col in range(0, int(camera.resolution[0])):
+			global_ray = camera.getRayForPixelInGlobalRef(col, 0)
+			global_ray_xz = np.asarray([global_ray[0], global_ray[2]])
+			xn_ray = mapPointToODSColumn(global_ray_xz, rig.viewing_circle_centre, ipd, eye)
+			temp_image[:, int(unnormalizeX(xn_ray, pan_width)), :] = renderer.image_list[i].getColumn(col)
+		output_image = np.maximum(output_image, temp_image)
+	return output_image
+
+
+def referenceViewInterpolation(renderer, cameraLeftID, cameraRightID, pan_width, direction, ipd, eye, flow,
+	pixelwise=False, origin=[0, 0, 0]):
+	# Per column (and per pixel) loop of the original viewInterpolationCwise and viewInterpolationPixelwise
+	rig = renderer.setupCamerasForRendering(ipd, origin)
+	centre = rig.viewing_circle_centre
+	camLeft = renderer.camera_list[cameraLeftID]
+	camRight = renderer.camera_list[cameraRightID]
+	image_width = int(camLeft.resolution[0])
+	image_height = int(camLeft.resolution[1])
+	theta_0_degree = radians2Degrees360(mapPointToODSAngle(rig.camera_positions[cameraLeftID], centre, ipd, eye))
+	theta_1_degree = radians2Degrees360(mapPointToODSAngle(rig.camera_positions[cameraRightID], centre, ipd, eye))
+	if direction == 'left2right':
+		start_col, end_col = int(camLeft.getCOPLeft()), image_width
+		camFirst, camSecond, frameIDFirst = camLeft, camRight, cameraLeftID
+	else:
+		start_col, end_col = 0, int(camLeft.getCOPLeft())
+		camFirst, camSecond, frameIDFirst = camRight, camLeft, cameraRightID
+	imageFirst = renderer.image_list[frameIDFirst].getImage()
+
+	output_image = np.zeros((image_height, int(pan_width), 3), dtype='uint8')
+	for col_id in range(start_col, end_col):
+		for row_id in (range(0, image_height) if pixelwise else [0]):
+			ray_first = camFirst.getRayForPixelInGlobalRef(col_id, row_id)
+			ray_first_xz = np.asarray((ray_first[0], ray_first[2]), dtype='float32')
+			theta_a_degree = radians2Degrees360(mapPointToODSAngle(ray_first_xz, centre, ipd, eye))
+
+			if pixelwise:
+				col_id_correspondence = col_id + flow[row_id, col_id, 1]
+				row_id_correspondence = row_id + flow[row_id, col_id, 0]
+			else:
+				col_id_correspondence = col_id + np.mean(flow[:, col_id, 1])
+				row_id_correspondence = 0
+			ray_second = camSecond.getRayForPixelInGlobalRef(col_id_correspondence, row_id_correspondence)
+			ray_second_xz = np.asarray((ray_second[0], ray_second[2]), dtype='float32')
+			theta_b_degree = radians2Degrees360(mapPointToODSAngle(ray_second_xz, centre, ipd, eye))
+
+			theta_p_degree = renderer.normalizeThenInterpolate(theta_0_degree, theta_1_degree, theta_a_degree,
+				theta_b_degree, eye)
+			xn_new = np.clip(thetaToNormalizedX(degrees3602Radians(theta_p_degree)), 0, 1)
+			ods_column = int(unnormalizeX(xn_new, pan_width))
+			if pixelwise:
+				output_image[row_id, ods_column, :] = imageFirst[row_id, col_id, :]
+			else:
+				output_image[:, ods_column, :] = imageFirst[:, col_id, :]
+	return output_image
+
+
+def countDifferentColumns(image_a, image_b):
+	# (number of columns that differ, largest difference in levels)
+	difference = np.abs(image_a.astype('int32') - image_b)
+	return int(np.count_nonzero(np.any(difference, axis=(0, 2)))), int(difference.max())
+
+
+def test_undistortedColumnLUT(calib_file):
+	# With undistortion, columns are mapped through the principal row, where distortion bends them
+	# the least. Expected columns come straight from cv2.undistortPoints at that row.
+	renderer = setupRenderer(calib_file)
+	renderer.camera_list.setUndistortRays(True)
+	ipd, eye, pan_width = 0.062, 1, 2000
+	rig = renderer.setupCamerasForRendering(ipd)
+	error = 0
+	for i in range(0, renderer.camera_list.getNumCameras()):
+		camera = renderer.camera_list[i]
+		width = int(camera.resolution[0])
+		points = np.stack((np.arange(width), np.full(width, camera.intrinsics[1][2])), axis=-1)
+		local_rays = np.concatenate((camera.undistortPoints(points).reshape(width, 2), np.ones((width, 2))), axis=1)
+		global_rays = np.dot(local_rays, np.asarray(camera.extrinsics_absolute, dtype='float64').T)
+		xn = mapPointToODSColumnArray(global_rays[:, [0, 2]], rig.viewing_circle_centre, ipd, eye)
+		expected = np.clip(unnormalizeX(xn, pan_width).astype('int32'), 0, pan_width-1)
+		error = max(error, int(np.abs(renderer.getColumnLUT(i, ipd, eye, pan_width) - expected).max()))
+	if error > 1:
+		raise RuntimeError('Undistorted column LUT differs from the principal row mapping by columns: ', error)
+	print('test_undistortedColumnLUT passed, max difference in columns ', error)
+
+
+def test_lookupTablesFollowCameras(calib_file):
+	# Tables built before a camera is changed in memory must not be reused afterwards
+	renderer = setupRenderer(calib_file)
+	renderer.render360NoInterpolation(0.064, [480, 1024])
+	camera = renderer.camera_list[2]
+	camera.intrinsics[0][2] += 15.0
+	camera.intrinsics_inverse = np.linalg.inv(camera.intrinsics)
+	changed = renderer.render360NoInterpolation(0.064, [480, 1024])
+	fresh = setupRenderer(calib_file)
+	fresh.setCameraList(renderer.camera_list)
+	expected = fresh.render360NoInterpolation(0.064, [480, 1024])
+	if not np.array_equal(changed, expected):
+		raise RuntimeError('Lookup tables are stale after a camera change')
+	print('test_lookupTablesFollowCameras passed')
+
+
+def test_linearOutputHeight(calib_file):
+	# Linear panaromas scale the image rows when the output height differs from the cameras
+	renderer = setupRenderer(calib_file)
+	reference = renderer.render360WithViewInterpolation(0.062, [480, 1000], eye=-1, vi_type='cwise')
+	for height in [300, 720]:
+		for render in [lambda: renderer.render360NoInterpolation(0.062, [height, 1000]),
+			lambda: renderer.render360WithViewInterpolation(0.062, [height, 1000], eye=-1, vi_type='cwise'),
+			lambda: renderer.render360WithViewInterpolation(0.062, [height, 1000], eye=-1, vi_type='pwise')]:
+			if render().shape != (height, 1000, 3):
+				raise RuntimeError('Linear panaroma does not have the requested height ', height)
+		scaled = renderer.render360WithViewInterpolation(0.062, [height, 1000], eye=-1, vi_type='cwise')
+		error = np.abs(cv2.resize(reference, (1000, height)).astype('int32') - scaled).mean()
+		if error > 0.1:
+			raise RuntimeError('Scaled linear panaroma differs from the resized one by ', error)
+	print('test_linearOutputHeight passed')
+
+
+def test_sweepMatchesSeparateRenders(calib_file):
+	# An IPD sweep shares flow between the IPDs, but must render exactly what separate renders do
+	ipds = [0.055, 0.062, 0.07]
+	sweep = setupRenderer(calib_file).renderStereo360Sweep(ipds, [480, 1200])
+	for ipd, (left, right) in zip(ipds, sweep):
+		expected_left, expected_right = setupRenderer(calib_file).renderStereo360(ipd, [480, 1200])
+		if not (np.array_equal(left, expected_left) and np.array_equal(right, expected_right)):
+			raise RuntimeError('IPD sweep differs from a separate render at ', ipd)
+	print('test_sweepMatchesSeparateRenders passed')
+
+
+def test_workerStateIgnoresCaches(calib_file):
+	# Renders at other IPDs fill caches and change per IPD values, neither may restart the worker pool
+	renderer = setupRenderer(calib_file)
+	renderer.renderStereo360(0.062, [480, 1000])
+	state_hash = renderer.getWorkerStateHash()
+	renderer.renderStereo360(0.07, [480, 1000])
+	renderer.render360InverseMapping(0.07, [480, 1000])
+	if renderer.getWorkerStateHash() != state_hash:
+		raise RuntimeError('Worker state changes with the IPD or the caches')
+	size = len(renderer.getWorkerState())
+	if size > 1024*1024:
+		raise RuntimeError('Worker state contains caches, size in bytes: ', size)
+	renderer.setProjection('equirectangular')
+	if renderer.getWorkerStateHash() == state_hash:
+		raise RuntimeError('Worker state does not follow the settings')
+	print('test_workerStateIgnoresCaches passed, state size in bytes ', size)
+
+
+def test_noInterpolationMatchesLoop(calib_file):
+	# The loop computes rays in float32 (getRayForPixelInGlobalRef), the column tables in float64,
+	# which moves one column boundary
+	renderer = setupRenderer(calib_file)
+	columns, levels = countDifferentColumns(renderer.render360NoInterpolation(0.062, [480, 2000]),
+		referenceNoInterpolation(renderer, 0.062, [480, 2000]))
+	if columns > 1:
+		raise RuntimeError('render360NoInterpolation differs from the column loop in columns: ', columns)
+	print('test_noInterpolationMatchesLoop passed, different columns ', columns)
+
+
+def test_columnwiseMatchesLoop(calib_file):
+	# Every partial image must match the column loop exactly. The composite differs because
+	# PanaromaCompositor averages all partial images with rounding, while the loop blended them 50/50
+	# in turn (updateODSPanaroma) and truncated. On the sample rig that is at most one level.
+	renderer = setupRenderer(calib_file)
+	ipd, eye, pan_width = 0.062, -1, 2000
+	expected = np.zeros((480, pan_width, 3), dtype='uint8')
+	for (cameraLeftID, cameraRightID, direction) in renderer.getViewInterpolationJobs():
+		flow = renderer.calculatePairFlow(cameraLeftID, cameraRightID, direction)
+		partial = renderer.viewInterpolationCwise(cameraLeftID, cameraRightID, cameraLeftID, cameraRightID,
+			pan_width, direction, ipd=ipd, eye=eye, flow=flow)
+		reference = referenceViewInterpolation(renderer, cameraLeftID, cameraRightID, pan_width, direction, ipd,
+			eye, flow)
+		if not np.array_equal(partial, reference):
+			raise RuntimeError('Column wise partial image differs from the column loop ', cameraLeftID, direction)
+		expected = renderer.updateODSPanaroma(expected, reference)
+	columns, levels = countDifferentColumns(
+		renderer.render360WithViewInterpolation(ipd, [480, pan_width], eye=eye, vi_type='cwise'), expected)
+	if levels > 1 or columns > 48:
+		raise RuntimeError('Column wise panaroma differs from the loop by ', levels, ' levels in columns: ', columns)
+	print('test_columnwiseMatchesLoop passed, composite differs by ', levels, ' level in columns: ', columns)
+
+
+def test_pixelwiseMatchesLoop(calib_file):
+	# The pixel loop is slow, so only the first pair is checked. The loop computes rays and flow
+	# correspondences in float32, the kernel in float64, which can change the pixel that lands last
+	# on a few panaroma pixels.
+	renderer = setupRenderer(calib_file)
+	ipd, eye, pan_width = 0.062, -1, 2000
+	(cameraLeftID, cameraRightID, direction) = renderer.getViewInterpolationJobs()[0]
+	flow = renderer.calculatePairFlow(cameraLeftID, cameraRightID, direction)
+	partial = renderer.viewInterpolationPixelwise(cameraLeftID, cameraRightID, cameraLeftID, cameraRightID,
+		pan_width, direction, ipd=ipd, eye=eye, flow=flow)
+	reference = referenceViewInterpolation(renderer, cameraLeftID, cameraRightID, pan_width, direction, ipd, eye,
+		flow, pixelwise=True)
+	pixels = int(np.count_nonzero(np.any(partial != reference, axis=2)))
+	if pixels > 4:
+		raise RuntimeError('Pixel wise partial image differs from the pixel loop in pixels: ', pixels)
+	print('test_pixelwiseMatchesLoop passed, different pixels ', pixels)
+
+
+def main():
+	args = arg_setup()
+	test_undistortedRayBundle(args["second"])
+	test_undistortedColumnLUT(args["second"])
+	test_lookupTablesFollowCameras(args["second"])
+	test_linearOutputHeight(args["second"])
+	test_sweepMatchesSeparateRenders(args["second"])
+	test_workerStateIgnoresCaches(args["second"])
+	test_noInterpolationMatchesLoop(args["second"])
+	test_columnwiseMatchesLoop(args["second"])
+	test_pixelwiseMatchesLoop(args["second"])
+
+
+if __name__ == '__main__':
+	main()
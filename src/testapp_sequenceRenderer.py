@@ -0,0 +1,56 @@
+from renderer import *
+from cameras import *
+from SequenceRenderer import *
+import argparse
+import os
+
+
+def arg_setup():
+	ap = argparse.ArgumentParser()
+	ap.add_argument("-f", "--first", required=True, help="path to data.yaml or to a recording directory (record0/camN/*.png)")
+	ap.add_argument("-s", "--second", required=True, help="path to calibration file")
+	ap.add_argument("-o", "--output", required=False, help="directory to write the stereo panaromas to")
+	ap.add_argument("-m", "--mode", default='interpolation', help="'interpolation' or 'remap'")
+	ap.add_argument("-w", "--workers", type=int, default=1, help="number of worker processes")
+	ap.add_argument("-p", "--projection", default='linear', help="'linear' or 'equirectangular'")
+	ap.add_argument("-t", "--warm-start", action='store_true', help="warm start the optical flow from the previous frame")
+	args = vars(ap.parse_args())
+	return args
+
+
+def test_sequence_renderer():
+	args = arg_setup()
+	cc = CameraCollection()
+	cc.readAllCameras(args["second"])
+
+	if os.path.isdir(args["first"]):
+		frames = getFramesFromDirectory(args["first"], cc.getNumCameras())
+	else:
+		frames = getFramesFromYAML(args["first"])
+
+	rods = RendererODS()
+	rods.setCameraList(cc)
+	camera_order = [0, 1, 2, 3, 8, 9, 6, 7, 4, 5, 0]
+	rods.setCameraOrder(camera_order)
+	rods.setProjection(args["projection"])
+	if args["projection"] == 'equirectangular':
+		output_image_dim = [1000, 2000]
+	else:
+		output_image_dim = [480, 2000]
+
+	seq = SequenceRenderer(rods, frames)
+	for (frame_name, pan_left, pan_right) in seq.render(0.062, output_image_dim, mode=args["mode"],
+		num_workers=args["workers"], warm_start_flow=args["warm_start"]):
+		print('rendered frame ', frame_name, '\tfps: ', seq.getFramesPerSecond())
+		if args["output"] is not None:
+			cv2.imwrite(os.path.join(args["output"], frame_name + '.png'), np.vstack((pan_left, pan_right)))
+
+	print('Rendered ', seq.frames_rendered, ' frames at ', seq.getFramesPerSecond(), ' frames per second')
+
+
+def main():
+	test_sequence_renderer()
+
+
+if __name__ == '__main__':
+	main()
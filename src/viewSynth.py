@@ -1,6 +1,10 @@
 import cv2
 import matplotlib.pyplot as plt
 import numpy as np
+import os
+import time
+import hashlib
+from collections import OrderedDict
 
 
 class OpticalFlowCalculator:
@@ -8,13 +12,133 @@ class OpticalFlowCalculator:
 	Sasha's implementation of optical flow packaged into a class.
 	"""
 	def __init__(self):
-		pass
+		# Farneback parameters: pyr_scale, levels, winsize, iterations, poly_n, poly_sigma, flags
+		self.parameters = (0.5, 3, 15, 3, 5, 1.2, 0)
+		# Flow can be computed on downscaled images (pyramid level > 0) and upsampled, optionally
+		# followed by one cheap Farneback pass at full resolution
+		self.pyramid_level = 0
+		self.refine = False
+		self.refine_parameters = (0.5, 1, 15, 1, 5, 1.2)
+		# Fewer pyramid levels and iterations when starting from the flow of the previous frame
+		self.warm_start_parameters = (0.5, 1, 15, 2, 5, 1.2)
+		# Time and error of every pyramid level, see profilePyramidLevels
+		self.level_profile = None
 
-	def calculateFlow(self, current_f, next_f):
+	def calculateFlow(self, current_f, next_f, initial_flow=None):
+		"""
+		Flow from current_f to next_f. initial_flow optionally warm starts the flow, e.g. with the flow
+		of the same cameras in the previous frame.
+		"""
+		cf, nf = self.getGrayImages(current_f, next_f)
+		if initial_flow is not None:
+			initial_flow = np.array(initial_flow, dtype='float32')
+		if self.pyramid_level == 0:
+			flow = self.calculateFlowGray(cf, nf, initial_flow)
+		else:
+			height, width = cf.shape[0:2]
+			scale = 2**self.pyramid_level
+			size = (max(1, int(round(float(width)/scale))), max(1, int(round(float(height)/scale))))
+			if initial_flow is not None:
+				initial_flow = cv2.resize(initial_flow, size, interpolation=cv2.INTER_AREA)
+				initial_flow[:, :, 0] *= float(size[0])/width
+				initial_flow[:, :, 1] *= float(size[1])/height
+			flow = self.calculateFlowGray(cv2.resize(cf, size, interpolation=cv2.INTER_AREA),
+				cv2.resize(nf, size, interpolation=cv2.INTER_AREA), initial_flow)
+			# Upsample and scale the vectors back to the source resolution
+			flow = cv2.resize(flow, (width, height), interpolation=cv2.INTER_LINEAR)
+			flow[:, :, 0] *= float(width)/size[0]
+			flow[:, :, 1] *= float(height)/size[1]
+		if self.refine:
+			flow = cv2.calcOpticalFlowFarneback(cf, nf, np.ascontiguousarray(flow, dtype='float32'),
+				*(self.refine_parameters + (cv2.OPTFLOW_USE_INITIAL_FLOW,)))
+		return flow
+
+	def calculateFlowGray(self, cf, nf, initial_flow=None):
+		# Backend specific flow between two gray images
+		if initial_flow is None:
+			return cv2.calcOpticalFlowFarneback(cf, nf, None, *self.parameters)
+		return cv2.calcOpticalFlowFarneback(cf, nf, initial_flow,
+			*(self.warm_start_parameters + (cv2.OPTFLOW_USE_INITIAL_FLOW,)))
+
+	def setPyramidLevel(self, level, refine=False):
+		"""
+		Computes flow on images downscaled by 2**level. Good enough where only the mean flow of a
+		column is used (column wise interpolation) and much cheaper.
+		"""
+		self.pyramid_level = int(level)
+		self.refine = refine
+
+	def profilePyramidLevels(self, current_f, next_f, levels=[0, 1, 2, 3], repeats=1):
+		"""
+		Time and mean endpoint error of the flow at every pyramid level, for the current backend and
+		refinement setting. The error is w.r.t. the flow at level 0 without refinement, whether or not
+		level 0 is in levels. Stored in level_profile and returned as a list of dicts with 'level',
+		'time' and 'endpoint_error'.
+		"""
+		pyramid_level = self.pyramid_level
+		refine = self.refine
+		self.pyramid_level = 0
+		self.refine = False
+		reference = self.calculateFlow(current_f, next_f)
+		self.refine = refine
+		profile = []
+		for level in sorted(levels):
+			self.pyramid_level = level
+			times = []
+			for i in range(repeats):
+				start = time.time()
+				flow = self.calculateFlow(current_f, next_f)
+				times.append(time.time() - start)
+			profile.append({'level': level, 'time': min(times), 'endpoint_error': getEndpointError(flow, reference)})
+		self.pyramid_level = pyramid_level
+		self.level_profile = profile
+		return profile
+
+	def choosePyramidLevel(self, time_budget):
+		"""
+		Sets the finest pyramid level of level_profile whose flow takes at most time_budget seconds,
+		or the fastest level if none does. Returns the level.
+		"""
+		if self.level_profile is None:
+			raise RuntimeError('Pyramid levels are not profiled. Call profilePyramidLevels first.')
+		within_budget = [entry for entry in self.level_profile if entry['time'] <= time_budget]
+		if len(within_budget) > 0:
+			level = min([entry['level'] for entry in within_budget])
+		else:
+			level = min(self.level_profile, key=lambda entry: entry['time'])['level']
+		self.setPyramidLevel(level, self.refine)
+		return level
+
+	def calculateFlowInColumns(self, current_f, next_f, start_col, end_col, initial_flow=None):
+		"""
+		Flow computed only on the columns [start_col, end_col) of both images, returned in full frame
+		co-ordinates. Flow outside of the columns is zero.
+		"""
+		height, width = current_f.shape[0:2]
+		start_col = max(0, int(start_col))
+		end_col = min(width, int(end_col))
+		if start_col == 0 and end_col == width:
+			return self.calculateFlow(current_f, next_f, initial_flow)
+		flow = np.zeros((height, width, 2), dtype='float32')
+		if end_col > start_col:
+			if initial_flow is not None:
+				initial_flow = initial_flow[:, start_col:end_col]
+			# Flow vectors are displacements, so they do not change when both images are cropped alike
+			flow[:, start_col:end_col] = self.calculateFlow(np.ascontiguousarray(current_f[:, start_col:end_col]),
+				np.ascontiguousarray(next_f[:, start_col:end_col]), initial_flow)
+		return flow
+
+	def getGrayImages(self, current_f, next_f):
 		cf = cv2.cvtColor(current_f, cv2.COLOR_BGR2GRAY)
 		nf = cv2.cvtColor(next_f, cv2.COLOR_BGR2GRAY)
-		flow = cv2.calcOpticalFlowFarneback(cf, nf, None, 0.5, 3, 15, 3, 5, 1.2, 0)
-		return flow
+		return cf, nf
+
+	def getParameters(self):
+		# Everything that changes the result of calculateFlow, used to key cached flow
+		return self.getBackendParameters() + ('level', self.pyramid_level, self.refine)
+
+	def getBackendParameters(self):
+		return ('farneback',) + tuple(self.parameters)
 
 	def getFlowInHSV(self, flow):
 		h, w = flow.shape[:2]
@@ -50,3 +174,437 @@ class OpticalFlowCalculator:
 
 # End class OpticalFlow
 
+
+class DISOpticalFlowCalculator(OpticalFlowCalculator):
+	"""
+	OpenCV's DIS optical flow. preset is 'ultrafast', 'fast' or 'medium'. Much faster than
+	Farneback, 'medium' is close to it in quality.
+	"""
+	def __init__(self, preset='fast'):
+		OpticalFlowCalculator.__init__(self)
+		presets = {'ultrafast': 'DISOPTICAL_FLOW_PRESET_ULTRAFAST', 'fast': 'DISOPTICAL_FLOW_PRESET_FAST',
+			'medium': 'DISOPTICAL_FLOW_PRESET_MEDIUM'}
+		if preset not in presets:
+			raise RuntimeError('Unknown DIS preset : ', preset)
+		if not hasattr(cv2, 'DISOpticalFlow_create'):
+			raise RuntimeError('DIS optical flow is not available in this OpenCV build')
+		self.preset = preset
+		self.preset_id = getattr(cv2, presets[preset])
+		self.dis = None
+		self.warm_start_dis = None
+
+	def __getstate__(self):
+		# OpenCV objects can not be pickled, worker processes create their own
+		state = self.__dict__.copy()
+		state['dis'] = None
+		state['warm_start_dis'] = None
+		return state
+
+	def calculateFlowGray(self, cf, nf, initial_flow=None):
+		# Created once and reused for every pair
+		if initial_flow is None:
+			if self.dis is None:
+				self.dis = cv2.DISOpticalFlow_create(self.preset_id)
+			return self.dis.calc(cf, nf, None)
+
+		# DIS starts from the flow passed in if it has the size of the images. Starting close to the
+		# solution, half the iterations are enough.
+		if self.warm_start_dis is None:
+			dis = cv2.DISOpticalFlow_create(self.preset_id)
+			dis.setGradientDescentIterations(max(1, dis.getGradientDescentIterations()//2))
+			dis.setVariationalRefinementIterations(max(1, dis.getVariationalRefinementIterations()//2))
+			self.warm_start_dis = dis
+		return self.warm_start_dis.calc(cf, nf, initial_flow)
+
+	def getBackendParameters(self):
+		return ('dis', self.preset)
+
+# End class DISOpticalFlowCalculator
+
+
+class SparseToDenseOpticalFlowCalculator(OpticalFlowCalculator):
+	"""
+	Flow tracked on a grid of points (one every grid_step pixels) and interpolated to every pixel.
+	Uses cv2.optflow.calcOpticalFlowSparseToDense when OpenCV is built with the contrib modules,
+	otherwise pyramidal Lucas-Kanade on the grid followed by bilinear upsampling.
+	"""
+	def __init__(self, grid_step=8):
+		OpticalFlowCalculator.__init__(self)
+		self.grid_step = grid_step
+
+	def calculateFlowGray(self, cf, nf, initial_flow=None):
+		# The contrib implementation can not be warm started
+		if hasattr(cv2, 'optflow'):
+			return cv2.optflow.calcOpticalFlowSparseToDense(cf, nf, grid_step=self.grid_step)
+
+		height, width = cf.shape[0:2]
+		grid_height = int(np.ceil(float(height)/self.grid_step))
+		grid_width = int(np.ceil(float(width)/self.grid_step))
+		x, y = np.meshgrid(np.arange(grid_width), np.arange(grid_height))
+		points = (np.stack((x, y), axis=-1).reshape(-1, 1, 2)*self.grid_step + self.grid_step/2.0).astype('float32')
+		points = np.minimum(points, np.array([width-1, height-1], dtype='float32'))
+		if initial_flow is None:
+			tracked, status, error = cv2.calcOpticalFlowPyrLK(cf, nf, points, None, winSize=(21, 21), maxLevel=3)
+		else:
+			grid = points.reshape(-1, 2).astype('int32')
+			guess = points + initial_flow[grid[:, 1], grid[:, 0]].reshape(-1, 1, 2)
+			tracked, status, error = cv2.calcOpticalFlowPyrLK(cf, nf, points, guess.astype('float32'),
+				winSize=(21, 21), maxLevel=1, flags=cv2.OPTFLOW_USE_INITIAL_FLOW)
+
+		grid_flow = (tracked - points).reshape(grid_height, grid_width, 2)
+		# Points that could not be tracked get the median flow of the others
+		lost = status.reshape(grid_height, grid_width) == 0
+		if np.all(lost):
+			grid_flow[:] = 0
+		elif np.any(lost):
+			grid_flow[lost] = np.median(grid_flow[~lost], axis=0)
+		# Every grid point is the centre of a grid_step x grid_step block
+		flow = cv2.resize(grid_flow, (grid_width*self.grid_step, grid_height*self.grid_step),
+			interpolation=cv2.INTER_LINEAR)
+		return np.ascontiguousarray(flow[0:height, 0:width])
+
+	def getBackendParameters(self):
+		return ('sparse_to_dense', self.grid_step, hasattr(cv2, 'optflow'))
+
+# End class SparseToDenseOpticalFlowCalculator
+
+
+class TemporalFlow:
+	"""
+	Warm starts the flow of every camera pair with the flow of the same pair in the previous frame,
+	for video from a static rig. A pair is computed from scratch on a scene cut, i.e. when the
+	previous flow explains the new images much worse (scene_cut_ratio) than it explained its own
+	frame when it was computed from scratch, and at least every max_warm_frames frames so errors do
+	not build up.
+	State is kept per pair key. getState / setState move the state of a pair to and from worker
+	processes, copies of this object sent to workers start without state. The statistics only count
+	the flow computed in this process.
+	"""
+	def __init__(self, scene_cut_ratio=2.0, min_residual=4.0, max_warm_frames=30):
+		self.scene_cut_ratio = scene_cut_ratio
+		self.min_residual = min_residual
+		self.max_warm_frames = max_warm_frames
+		self.reset()
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state['pairs'] = {}
+		state.update({'warm_starts': 0, 'cold_starts': 0, 'scene_cuts': 0})
+		return state
+
+	def reset(self):
+		self.pairs = {}
+		self.warm_starts = 0
+		self.cold_starts = 0
+		self.scene_cuts = 0
+
+	def getState(self, pair_key):
+		return self.pairs.get(pair_key)
+
+	def setState(self, pair_key, state):
+		if state is not None:
+			self.pairs[pair_key] = state
+
+	def getFlow(self, image_from, image_to, calculator, pair_key, columns=None):
+		"""
+		Flow from image_from to image_to for the pair pair_key, warm started from the previous frame
+		if possible. columns optionally restricts the flow, see calculateFlowInColumns.
+		"""
+		if columns is None:
+			columns = (0, image_from.shape[1])
+		columns = (max(0, int(columns[0])), min(image_from.shape[1], int(columns[1])))
+		parameters = calculator.getParameters()
+		images = (hashlib.sha1(np.ascontiguousarray(image_from).data).hexdigest(),
+			hashlib.sha1(np.ascontiguousarray(image_to).data).hexdigest())
+		state = self.pairs.get(pair_key)
+
+		initial_flow = None
+		if state is not None and state['parameters'] == parameters:
+			# Same frame again, e.g. for the other eye
+			if state['images'] == images and state['columns'] == columns:
+				return state['flow']
+			if state['warm_frames'] < self.max_warm_frames:
+				residual = getFlowResidual(image_from, image_to, state['flow'], columns)
+				if residual > max(self.scene_cut_ratio*state['residual'], self.min_residual):
+					self.scene_cuts = self.scene_cuts + 1
+				else:
+					initial_flow = state['flow']
+
+		flow = calculator.calculateFlowInColumns(image_from, image_to, columns[0], columns[1], initial_flow)
+		flow.setflags(write=False)
+		if initial_flow is None:
+			self.cold_starts = self.cold_starts + 1
+			# Reference for detecting scene cuts in the following frames
+			residual = getFlowResidual(image_from, image_to, flow, columns)
+			warm_frames = 0
+		else:
+			self.warm_starts = self.warm_starts + 1
+			residual = state['residual']
+			warm_frames = state['warm_frames'] + 1
+		self.pairs[pair_key] = {'flow': flow, 'residual': residual, 'images': images, 'columns': columns,
+			'parameters': parameters, 'warm_frames': warm_frames}
+		return flow
+
+	def getStatistics(self):
+		return {'warm_starts': self.warm_starts, 'cold_starts': self.cold_starts, 'scene_cuts': self.scene_cuts}
+
+# End class TemporalFlow
+
+
+def getFlowResidual(image_from, image_to, flow, columns=None):
+	"""
+	Mean absolute gray level difference between image_from and image_to warped back with flow, over
+	the columns (start_col, end_col).
+	"""
+	if columns is None:
+		columns = (0, image_from.shape[1])
+	start_col, end_col = columns
+	gray_from = cv2.cvtColor(image_from, cv2.COLOR_BGR2GRAY)[:, start_col:end_col]
+	gray_to = cv2.cvtColor(image_to, cv2.COLOR_BGR2GRAY)
+	band_flow = flow[:, start_col:end_col]
+	x, y = np.meshgrid(np.arange(start_col, end_col, dtype='float32'), np.arange(flow.shape[0], dtype='float32'))
+	warped = cv2.remap(gray_to, x + band_flow[:, :, 0], y + band_flow[:, :, 1], cv2.INTER_LINEAR,
+		borderMode=cv2.BORDER_REPLICATE)
+	return float(np.mean(cv2.absdiff(warped, gray_from)))
+
+
+# Flow backends by name, and by speed / quality tier
+flow_backends = {
+	'farneback': lambda: OpticalFlowCalculator(),
+	'dis_ultrafast': lambda: DISOpticalFlowCalculator('ultrafast'),
+	'dis_fast': lambda: DISOpticalFlowCalculator('fast'),
+	'dis_medium': lambda: DISOpticalFlowCalculator('medium'),
+	'sparse_to_dense': lambda: SparseToDenseOpticalFlowCalculator()}
+flow_tiers = {'quality': 'farneback', 'balanced': 'dis_medium', 'fast': 'dis_fast', 'fastest': 'dis_ultrafast'}
+
+
+def createOpticalFlowCalculator(name='farneback'):
+	"""
+	Flow calculator for a backend name (see flow_backends) or a tier (see flow_tiers).
+	"""
+	name = flow_tiers.get(name, name)
+	if name not in flow_backends:
+		raise RuntimeError('Unknown optical flow backend : ', name)
+	return flow_backends[name]()
+
+
+def getEndpointError(flow, reference_flow, mask=None):
+	"""
+	Mean endpoint error (euclidean distance between the flow vectors) of flow w.r.t. reference_flow,
+	optionally only over the pixels where mask is set.
+	"""
+	errors = np.linalg.norm(flow - reference_flow, axis=-1)
+	if mask is not None:
+		errors = errors[mask]
+	return float(np.mean(errors))
+
+
+class FlowCache:
+	"""
+	Caches optical flow keyed by the content of both images and the parameters of the flow
+	calculator, so the flow of an image pair is computed once for both eyes, every IPD and every
+	re-render. Recently used flow is kept in memory (at most max_entries fields). If a cache
+	directory is set, flow is also stored on disk as compressed .npz, optionally as int16 fixed
+	point (1/fixed_point_scale pixel steps) to halve the size.
+	"""
+	def __init__(self, max_entries=20, cache_dir=None, fixed_point=False, fixed_point_scale=16.0):
+		self.max_entries = max_entries
+		self.fixed_point = fixed_point
+		self.fixed_point_scale = fixed_point_scale
+		self.entries = OrderedDict()
+		self.cache_dir = None
+		self.setCacheDirectory(cache_dir)
+		self.resetStatistics()
+
+	def __getstate__(self):
+		# Copies sent to worker processes start with an empty memory tier and statistics, the disk tier
+		# is shared. Flow computed by workers is added to the cache of the renderer, see runRenderJobs.
+		state = self.__dict__.copy()
+		state['entries'] = OrderedDict()
+		state.update({'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0})
+		return state
+
+	def setCacheDirectory(self, cache_dir):
+		self.cache_dir = cache_dir
+		if cache_dir is not None and not os.path.isdir(cache_dir):
+			os.makedirs(cache_dir)
+
+	def resetStatistics(self):
+		self.hits = 0
+		self.disk_hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def getStatistics(self):
+		return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+			'evictions': self.evictions, 'entries': len(self.entries), 'hit_rate': self.getHitRate()}
+
+	def getHitRate(self):
+		# Hits from memory and disk over all lookups
+		lookups = self.hits + self.disk_hits + self.misses
+		if lookups == 0:
+			return 0.0
+		return float(self.hits + self.disk_hits)/lookups
+
+	def getImageHash(self, image):
+		image = np.ascontiguousarray(image)
+		image_hash = hashlib.sha1(image.data)
+		image_hash.update(repr((image.shape, image.dtype.str)).encode('utf-8'))
+		return image_hash.hexdigest()
+
+	def getKey(self, image_from, image_to, parameters):
+		return (self.getImageHash(image_from), self.getImageHash(image_to), repr(tuple(parameters)))
+
+	def getFlowPath(self, key):
+		key_hash = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+		return os.path.join(self.cache_dir, 'flow_' + key_hash[:20] + '.npz')
+
+	def getFlow(self, image_from, image_to, calculator, columns=None):
+		"""
+		Flow from image_from to image_to as computed by calculator.calculateFlow, from the cache if
+		possible. If columns (start_col, end_col) is given, flow is only computed for these columns,
+		see OpticalFlowCalculator.calculateFlowInColumns.
+		"""
+		key = self.getFlowKey(image_from, image_to, calculator, columns)
+		flow = self.lookupFlow(key)
+		if flow is None:
+			if columns is not None:
+				flow = calculator.calculateFlowInColumns(image_from, image_to, columns[0], columns[1])
+			else:
+				flow = calculator.calculateFlow(image_from, image_to)
+			flow = self.addFlow(key, flow)
+		return flow
+
+	def getFlowKey(self, image_from, image_to, calculator, columns=None):
+		parameters = calculator.getParameters()
+		if columns is not None:
+			parameters = parameters + ('columns', int(columns[0]), int(columns[1]))
+		return self.getKey(image_from, image_to, parameters)
+
+	def lookupFlow(self, key):
+		"""
+		Flow stored under key (see getFlowKey) in memory or on disk. Returns None and counts a miss if
+		it is not cached.
+		"""
+		if key in self.entries:
+			self.hits = self.hits + 1
+			self.entries.move_to_end(key)
+			return self.entries[key]
+
+		flow = None
+		if self.cache_dir is not None:
+			flow = self.loadFlow(key)
+		if flow is None:
+			self.misses = self.misses + 1
+			return None
+		self.disk_hits = self.disk_hits + 1
+		return self.addFlow(key, flow, save=False)
+
+	def addFlow(self, key, flow, save=True):
+		"""
+		Stores flow computed elsewhere (e.g. by a worker process) under key. With save=False it is not
+		written to disk, e.g. because it was loaded from there or the worker already wrote it.
+		"""
+		if save and self.cache_dir is not None:
+			self.saveFlow(key, flow)
+		# Shared between callers, so it must not be modified in place
+		flow.setflags(write=False)
+		self.entries[key] = flow
+		self.entries.move_to_end(key)
+		while len(self.entries) > self.max_entries:
+			self.entries.popitem(last=False)
+			self.evictions = self.evictions + 1
+		return flow
+
+	def loadFlow(self, key):
+		path = self.getFlowPath(key)
+		if not os.path.isfile(path):
+			return None
+		with np.load(path) as data:
+			flow = data['flow']
+			if flow.dtype == np.int16:
+				flow = flow.astype('float32')/float(data['scale'])
+		return flow
+
+	def saveFlow(self, key, flow):
+		if self.fixed_point:
+			limit = np.iinfo(np.int16).max
+			data = {'flow': np.clip(np.rint(flow*self.fixed_point_scale), -limit, limit).astype('int16'),
+				'scale': self.fixed_point_scale}
+		else:
+			data = {'flow': flow}
+		# Written under a temporary name first, so other processes never read a partial file
+		path = self.getFlowPath(key)
+		temp_path = path + '.' + str(os.getpid()) + '.tmp'
+		with open(temp_path, 'wb') as stream:
+			np.savez_compressed(stream, **data)
+		os.replace(temp_path, path)
+
+	def clear(self):
+		self.entries = OrderedDict()
+
+# End class FlowCache
+
+
+class PanaromaCompositor:
+	"""
+	Merges partial ODS renders into one panaroma. Partial images are accumulated in a float buffer
+	together with a weight buffer, and the result is normalized once at the end.
+	coverage='column' counts a column of a partial image as covered if any of its pixels is non zero,
+	coverage='pixel' does the same per pixel.
+	"""
+	def __init__(self, image_dim, coverage='column'):
+		if coverage not in ['column', 'pixel']:
+			raise RuntimeError('Unknown coverage type : ', coverage)
+		self.height = int(image_dim[0])
+		self.width = int(image_dim[1])
+		self.coverage = coverage
+		self.accumulator = np.zeros((self.height, self.width, 3), dtype='float32')
+		self.weights = np.zeros((self.height, self.width), dtype='float32')
+
+	def reset(self):
+		self.accumulator[:] = 0
+		self.weights[:] = 0
+
+	def addImage(self, partial_image, column_weights=None):
+		"""
+		Adds a partial render. column_weights optionally gives a blend weight for every panaroma
+		column, e.g. from getFeatherWeights.
+		"""
+		if partial_image.shape[0:2] != (self.height, self.width):
+			raise RuntimeError('Partial image does not match the size of the panaroma')
+		if self.coverage == 'column':
+			weights = np.any(partial_image, axis=(0, 2)).astype('float32')[np.newaxis, :]
+		else:
+			weights = np.any(partial_image, axis=2).astype('float32')
+		if column_weights is not None:
+			weights = weights*np.asarray(column_weights, dtype='float32')[np.newaxis, :]
+		weights = np.broadcast_to(weights, (self.height, self.width))
+
+		self.accumulator += partial_image*weights[:, :, np.newaxis]
+		self.weights += weights
+
+	def getPanaroma(self, out=None):
+		"""
+		Normalized panaroma as uint8. Pixels that no partial image covered are zero.
+		"""
+		if out is None:
+			out = np.zeros((self.height, self.width, 3), dtype='uint8')
+		weights = np.maximum(self.weights, 1e-6)[:, :, np.newaxis]
+		np.copyto(out, np.clip(np.rint(self.accumulator/weights), 0, 255), casting='unsafe')
+		return out
+
+# End class PanaromaCompositor
+
+
+def getFeatherWeights(pan_width, centre_col, feather_width=None, min_weight=0.05):
+	"""
+	Blend weight for every panaroma column that falls off linearly with the (wrapped around)
+	distance from centre_col, e.g. the column where a camera's centre of projection is mapped.
+	"""
+	if feather_width is None:
+		feather_width = pan_width/4.0
+	cols = np.arange(pan_width, dtype='float32')
+	dist = np.abs(cols - centre_col)
+	dist = np.minimum(dist, pan_width - dist)
+	return np.clip(1 - dist/feather_width, min_weight, 1.0)